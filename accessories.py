@@ -0,0 +1,183 @@
+"""
+GPU・付属品の構造化モジュール
+
+自由記述の gpu_accessories（例: "NVIDIA RTX 4090 x2, 追加メモリ32GB"）を部品ごとに分解し、
+server_components テーブル（種別・型番・数量・容量）に保持する。
+サーバの登録・更新時に同じトランザクションで書き直すため、GPU の搭載数や設置場所別の合計は
+文字列の部分一致ではなくインデックスを使った集計で求められる。
+
+    python accessories.py parse "NVIDIA A100 80GB x2, 追加メモリ32GB"   # 解析結果の確認
+    python accessories.py rebuild                                        # 全サーバの部品を解析し直す
+
+pandas に依存しない（スキーマ初期化から呼び出すため）。
+"""
+import argparse
+import re
+import sys
+import unicodedata
+from typing import NamedTuple, Optional, Iterable
+
+
+class Component(NamedTuple):
+    """GPU・付属品の1部品"""
+    type: str
+    model: Optional[str]
+    count: int
+    memory_gb: Optional[int]  # GPU メモリ・増設メモリ・ストレージの容量（GB）
+
+
+# 部品の種別
+TYPE_GPU = 'GPU'
+TYPE_MEMORY = 'MEMORY'
+TYPE_STORAGE = 'STORAGE'
+TYPE_NIC = 'NIC'
+TYPE_OTHER = 'OTHER'
+
+# server_components に書き込む列
+COMPONENT_COLUMNS = 'server_id, type, model, count, memory_gb'
+
+_ITEM_SEPARATOR = re.compile(r'[,、;\n+]+')
+# 数量: 「2x A100」「2枚 A100」/「A100 x2」「A100×2」「A100 2枚」
+_COUNT_PREFIX = re.compile(r'^(?P<count>\d+)\s*(?:[x×*]|枚|基|個|本)\s*(?P<body>.+)$', re.IGNORECASE)
+_COUNT_SUFFIX = re.compile(
+    r'^(?P<body>.+?)\s*(?:(?:[×*]|(?<=\s)x|(?<=\d)x)\s*(?P<count>\d+)|(?P<unit_count>\d+)\s*(?:枚|基|個|本))$',
+    re.IGNORECASE
+)
+# 容量: 「32GB」「1TB」「24GiB」（10GbE などの通信速度は対象外）
+_CAPACITY = re.compile(r'(?P<size>\d+(?:\.\d+)?)\s*(?P<unit>GB|GiB|TB|TiB)(?![A-Za-z])', re.IGNORECASE)
+
+_TYPE_PATTERNS = [
+    (TYPE_GPU, re.compile(
+        r'NVIDIA|GEFORCE|RTX|GTX|TESLA|QUADRO|RADEON|INSTINCT|GAUDI|GPU|'
+        r'(?<![A-Z0-9])(?:MI\d{2,3}|[ABHLTVP]\d{1,3}[A-Z]?)(?![0-9])'
+    )),
+    (TYPE_MEMORY, re.compile(r'メモリ|MEMORY|RAM|DIMM|DDR\d')),
+    (TYPE_STORAGE, re.compile(r'SSD|HDD|NVME|ストレージ|ディスク')),
+    (TYPE_NIC, re.compile(r'NIC|\d+\s*GBE|CONNECTX|INFINIBAND|HBA|ネットワーク|LAN')),
+]
+# 型番から除く語（メーカー名・補足）
+_NOISE_WORDS = re.compile(r'NVIDIA|GEFORCE|TESLA|AMD|RADEON INSTINCT|INTEL|追加|増設|搭載|GPU(?=\s|$)')
+# 部品なしを表す記述
+_EMPTY_ITEM = re.compile(r'^(?:なし|無し|-+|N/?A|NONE)$', re.IGNORECASE)
+
+
+class AccessoryParser:
+    """GPU・付属品の自由記述を部品のリストに分解するクラス"""
+
+    @staticmethod
+    def parse(text: Optional[str]) -> list[Component]:
+        """自由記述を部品のリストに分解（空欄は空リスト、解釈できない部分は OTHER として残す）"""
+        components = []
+        for item in _ITEM_SEPARATOR.split(unicodedata.normalize('NFKC', text or '')):
+            item = re.sub(r'[()\[\]]', ' ', item).strip()
+            if item and not _EMPTY_ITEM.match(item):
+                components.append(AccessoryParser._parse_item(item))
+        return components
+
+    @staticmethod
+    def _parse_item(item: str) -> Component:
+        """1部品分の記述を解析"""
+        count = 1
+        match = _COUNT_PREFIX.match(item) or _COUNT_SUFFIX.match(item)
+        if match:
+            count, item = int(match.group('count') or match.group('unit_count')), match.group('body')
+
+        memory_gb = None
+        capacity = _CAPACITY.search(item)
+        if capacity:
+            size = float(capacity.group('size'))
+            memory_gb = int(size * 1024 if capacity.group('unit').upper().startswith('T') else size)
+            item = item[:capacity.start()] + ' ' + item[capacity.end():]
+
+        upper = item.upper()
+        component_type = next(
+            (name for name, pattern in _TYPE_PATTERNS if pattern.search(upper)), TYPE_OTHER
+        )
+        return Component(component_type, AccessoryParser.normalize_model(item), max(count, 1), memory_gb)
+
+    @staticmethod
+    def normalize_model(text: str) -> Optional[str]:
+        """型番の正規化（大文字化・メーカー名の除去・区切りの統一。検索条件の型番にも使う）"""
+        model = _NOISE_WORDS.sub(' ', unicodedata.normalize('NFKC', text).upper())
+        model = re.sub(r'[\s\-_/]+', ' ', model).strip()
+        return model or None
+
+
+class ComponentIndex:
+    """server_components テーブルの書き込みを行うクラス
+
+    呼び出し側の接続・トランザクションで実行し、コミットは呼び出し側で行う。
+    """
+
+    INSERT_SQL = f'INSERT INTO server_components ({COMPONENT_COLUMNS}) VALUES (?, ?, ?, ?, ?)'
+
+    @staticmethod
+    def rows(server_id: int, text: Optional[str]) -> list[tuple]:
+        """サーバの部品行を生成"""
+        return [(server_id, *component) for component in AccessoryParser.parse(text)]
+
+    @staticmethod
+    def sync(conn, server_id: int, text: Optional[str]):
+        """サーバの部品行を gpu_accessories の内容で書き直す"""
+        conn.execute('DELETE FROM server_components WHERE server_id = ?', (server_id,))
+        rows = ComponentIndex.rows(server_id, text)
+        if rows:
+            conn.executemany(ComponentIndex.INSERT_SQL, rows)
+
+    @staticmethod
+    def delete(conn, server_ids: Iterable[int]):
+        """削除したサーバの部品行を削除"""
+        conn.executemany('DELETE FROM server_components WHERE server_id = ?', [(i,) for i in server_ids])
+
+    @staticmethod
+    def backfill(conn) -> int:
+        """部品行のないサーバの gpu_accessories を解析して登録（登録したサーバ数を返す）"""
+        pending = conn.execute('''
+            SELECT s.id, s.gpu_accessories FROM servers s
+            WHERE s.gpu_accessories IS NOT NULL AND s.gpu_accessories != ''
+              AND NOT EXISTS (SELECT 1 FROM server_components c WHERE c.server_id = s.id)
+        ''').fetchall()
+        rows = [row for server_id, text in pending for row in ComponentIndex.rows(server_id, text)]
+        if rows:
+            conn.executemany(ComponentIndex.INSERT_SQL, rows)
+        return len(pending)
+
+    @staticmethod
+    def rebuild(conn) -> int:
+        """全サーバの部品行を作り直す（解析規則を変更した後に実行）"""
+        conn.execute('DELETE FROM server_components')
+        return ComponentIndex.backfill(conn)
+
+
+def main(argv: list[str] = None) -> int:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="GPU・付属品の構造化")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parse_parser = subparsers.add_parser('parse', help="記述の解析結果を表示")
+    parse_parser.add_argument('text')
+    subparsers.add_parser('rebuild', help="全サーバの部品を解析し直す")
+    args = parser.parse_args(argv)
+
+    if args.command == 'parse':
+        for component in AccessoryParser.parse(args.text):
+            print(component)
+        return 0
+
+    from db_core import init_database, get_db_connection
+    from shard_router import ShardRouter
+    init_database()
+
+    def rebuild() -> int:
+        with get_db_connection() as conn:
+            count = ComponentIndex.rebuild(conn)
+            conn.commit()
+            return count
+
+    # サイト別シャードが有効な場合は各シャードで作り直す
+    count = sum(ShardRouter.get().gather(rebuild))
+    print(f"{count:,} 台の部品を登録しました。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
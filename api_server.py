@@ -0,0 +1,382 @@
+"""
+ヘッドレス JSON API
+
+Streamlit を介さずに ServerService を操作するための HTTP API。
+サイドカーとして起動する:
+
+    API_TOKEN=secret python api_server.py --port 8502
+
+エンドポイント:
+    GET    /servers?q=<フィルタ>&limit=&cursor=   一覧・検索（Accept: application/x-ndjson で全件ストリーミング）
+    GET    /servers/{id}                          取得
+    POST   /servers                               作成
+    PUT    /servers/{id}                          全項目更新（If-Match 必須）
+    PATCH  /servers/{id}                          部分更新（If-Match 必須）
+    DELETE /servers/{id}                          削除（If-Match 必須）
+    POST   /servers/bulk                          一括更新 [{"id", "version", "fields"}]
+    GET    /servers/{id}/history                  サーバの編集履歴
+    GET    /history                               全編集履歴
+
+行の version を ETag として返し、If-Match の不一致は 412 とする。
+一覧の ETag はデータ世代（サーバと、作成者・更新者の表示名を引くユーザー）と検索条件から作るため、変更がなければ If-None-Match で 304 を返す。
+認証は Authorization: Bearer <API_TOKEN>、変更者は X-User-Email ヘッダー（省略時 "api"）。
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any
+from urllib.parse import urlsplit, parse_qs
+
+import pandas as pd
+
+from config import (
+    API_HOST, API_PORT, API_TOKEN, API_DEFAULT_PAGE_SIZE, API_MAX_PAGE_SIZE,
+    FIELD_MAPPING, JOB_CHUNK_SIZE
+)
+from auth import AuthManager
+from db_core import init_database
+from filter_query import FilterSyntaxError
+from server_service import ServerService
+
+_SERVER_PATH = re.compile(r'^/servers/(\d+)$')
+_SERVER_HISTORY_PATH = re.compile(r'^/servers/(\d+)/history$')
+
+
+class APIError(Exception):
+    """HTTP ステータス付きのエラー"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _version_etag(version: int) -> str:
+    """行バージョンの ETag"""
+    return f'"{version}"'
+
+
+def _parse_etag(value: str) -> Optional[int]:
+    """If-Match / If-None-Match のバージョンを取得（'*' は None）"""
+    value = value.strip()
+    if value == '*':
+        return None
+    value = value.removeprefix('W/').strip('"')
+    try:
+        return int(value)
+    except ValueError:
+        raise APIError(400, f"不正な ETag です: {value}")
+
+
+def _records_json(df: pd.DataFrame) -> str:
+    """DataFrame を JSON 配列文字列に変換"""
+    return df.to_json(orient='records', force_ascii=False, date_format='iso')
+
+
+class InventoryAPIHandler(BaseHTTPRequestHandler):
+    """サーバ在庫 API のリクエストハンドラ"""
+
+    server_service = ServerService()
+
+    # --- ディスパッチ ---
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method: str):
+        """認証・ルーティング・エラー処理"""
+        url = urlsplit(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        path = url.path.rstrip('/') or '/'
+
+        try:
+            self._authenticate()
+            with AuthManager.acting_as(self.headers.get('X-User-Email') or 'api'):
+                self._route(method, path)
+        except APIError as e:
+            self._send_json(e.status, {'error': e.message})
+        except FilterSyntaxError as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            print(f"Error handling {method} {self.path}: {e}")
+            self._send_json(500, {'error': "内部エラーが発生しました。"})
+
+    def _route(self, method: str, path: str):
+        """パスとメソッドから処理を選択"""
+        if path == '/servers':
+            if method == 'GET':
+                return self._list_servers()
+            if method == 'POST':
+                return self._create_server()
+        elif path == '/servers/bulk' and method == 'POST':
+            return self._bulk_update()
+        elif path == '/history' and method == 'GET':
+            return self._get_history(None)
+        elif match := _SERVER_HISTORY_PATH.match(path):
+            if method == 'GET':
+                return self._get_history(int(match.group(1)))
+        elif match := _SERVER_PATH.match(path):
+            server_id = int(match.group(1))
+            if method == 'GET':
+                return self._get_server(server_id)
+            if method in ('PUT', 'PATCH'):
+                return self._update_server(server_id, partial=method == 'PATCH')
+            if method == 'DELETE':
+                return self._delete_server(server_id)
+        else:
+            raise APIError(404, "見つかりません。")
+        raise APIError(405, "許可されていないメソッドです。")
+
+    # --- サーバ ---
+
+    def _list_servers(self):
+        """一覧・検索（条件付き GET・カーソルページング・NDJSON）"""
+        search_term = self.query.get('q', '')
+        generation = self.server_service.get_generation()
+        user_generation = self.server_service.get_user_generation()
+        digest = hashlib.sha1(self.path.encode('utf-8')).hexdigest()[:16]
+        etag = f'W/"{generation}.{user_generation}-{digest}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self._send_not_modified(etag)
+
+        if 'application/x-ndjson' in self.headers.get('Accept', ''):
+            chunks = self.server_service.iter_search_results(search_term, JOB_CHUNK_SIZE)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+            self.send_header('ETag', etag)
+            self.end_headers()
+            for chunk in chunks:
+                lines = chunk.to_json(orient='records', lines=True, force_ascii=False, date_format='iso')
+                self.wfile.write((lines.rstrip('\n') + '\n').encode('utf-8'))
+            return
+
+        try:
+            limit = min(int(self.query.get('limit', API_DEFAULT_PAGE_SIZE)), API_MAX_PAGE_SIZE)
+            cursor = int(self.query['cursor']) if 'cursor' in self.query else None
+        except ValueError:
+            raise APIError(400, "limit・cursor には数値を指定してください。")
+
+        df = self.server_service.list_servers_page(search_term, cursor, limit)
+        next_cursor = int(df['id'].iloc[-1]) if len(df) == limit else None
+        body = f'{{"items": {_records_json(df)}, "next_cursor": {json.dumps(next_cursor)}}}'
+        self._send_raw(200, body, {'ETag': etag})
+
+    def _get_server(self, server_id: int):
+        """取得（If-None-Match によるバージョン比較）"""
+        server = self._require_server(server_id)
+        etag = _version_etag(server['version'])
+        if self.headers.get('If-None-Match') == etag:
+            return self._send_not_modified(etag)
+        self._send_json(200, server, {'ETag': etag})
+
+    def _create_server(self):
+        """作成"""
+        body = self._read_json(dict)
+        server_data = {field: body.get(field) or '' for field in FIELD_MAPPING}
+        is_valid, error_message = self.server_service.validate_server_data(server_data)
+        if not is_valid:
+            raise APIError(400, error_message)
+
+        server_id = self.server_service.create_server(server_data)
+        server = self.server_service.get_server_by_id(server_id)
+        self._send_json(201, server, {
+            'ETag': _version_etag(server['version']),
+            'Location': f'/servers/{server_id}',
+        })
+
+    def _update_server(self, server_id: int, partial: bool):
+        """更新（If-Match 必須、不一致は 412）"""
+        if 'If-Match' not in self.headers:
+            raise APIError(428, "If-Match ヘッダーが必要です。")
+        expected_version = _parse_etag(self.headers['If-Match'])
+
+        current = self._require_server(server_id)
+        if expected_version is None:
+            expected_version = current['version']
+        if current['version'] != expected_version:
+            return self._send_precondition_failed(current)
+
+        body = self._read_json(dict)
+        unknown = set(body) - set(FIELD_MAPPING)
+        if unknown:
+            raise APIError(400, f"不明な項目です: {', '.join(sorted(unknown))}")
+        base = current if partial else {}
+        new_data = {field: body.get(field, base.get(field)) or '' for field in FIELD_MAPPING}
+        is_valid, error_message = self.server_service.validate_server_data(new_data)
+        if not is_valid:
+            raise APIError(400, error_message)
+
+        success, message = self.server_service.update_server(
+            server_id, {**current, 'version': expected_version}, new_data
+        )
+        if not success:
+            latest = self._require_server(server_id)
+            if latest['version'] != expected_version:
+                return self._send_precondition_failed(latest)
+            raise APIError(500, message)
+
+        server = self.server_service.get_server_by_id(server_id)
+        self._send_json(200, server, {'ETag': _version_etag(server['version'])})
+
+    def _delete_server(self, server_id: int):
+        """削除（If-Match 必須、不一致は 412）"""
+        if 'If-Match' not in self.headers:
+            raise APIError(428, "If-Match ヘッダーが必要です。")
+        expected_version = _parse_etag(self.headers['If-Match'])
+
+        current = self._require_server(server_id)
+        if expected_version is not None and current['version'] != expected_version:
+            return self._send_precondition_failed(current)
+
+        if not self.server_service.delete_server(server_id, AuthManager.get_current_email(), expected_version):
+            latest = self.server_service.get_server_by_id(server_id)
+            if latest is None:
+                raise APIError(404, "サーバが見つかりません。")
+            if expected_version is not None and latest['version'] != expected_version:
+                return self._send_precondition_failed(latest)
+            raise APIError(500, "サーバの削除に失敗しました。")
+        self.send_response(204)
+        self.end_headers()
+
+    def _bulk_update(self):
+        """一括更新（競合した行はスキップ）"""
+        items = self._read_json(list)
+        try:
+            requested = {int(item['id']): (int(item['version']), dict(item['fields'])) for item in items}
+        except (KeyError, TypeError, ValueError):
+            raise APIError(400, '各要素に "id"・"version"・"fields" を指定してください。')
+        for _, fields in requested.values():
+            unknown = set(fields) - set(FIELD_MAPPING)
+            if unknown:
+                raise APIError(400, f"不明な項目です: {', '.join(sorted(unknown))}")
+            invalid = [field for field, value in fields.items() if not isinstance(value, str)]
+            if invalid:
+                raise APIError(400, f"値は文字列で指定してください: {', '.join(sorted(invalid))}")
+
+        if not requested:
+            return self._send_json(200, {'updated': 0, 'conflicts': 0})
+
+        ids = list(requested)
+        current = self.server_service.get_servers_by_ids(ids).set_index('id')
+        updates = []
+        for server_id, (version, fields) in requested.items():
+            if server_id not in current.index:
+                # 存在しない行は競合として数える
+                updates.append((server_id, version, {}, fields))
+                continue
+            # 保守期限の変更で保守契約状態も変わるため、変更前の値は全項目を渡す
+            old_data = {k: None if pd.isna(v) else v for k, v in current.loc[server_id].to_dict().items()
+                        if k in FIELD_MAPPING}
+            is_valid, error_message = self.server_service.validate_server_data({**old_data, **fields})
+            if not is_valid:
+                raise APIError(400, f"ID {server_id}: {error_message}")
+            updates.append((server_id, version, old_data, fields))
+
+        updated, conflicts = self.server_service.bulk_update_servers(updates)
+        self._send_json(200, {'updated': updated, 'conflicts': conflicts})
+
+    # --- 履歴 ---
+
+    def _get_history(self, server_id: Optional[int]):
+        """編集履歴"""
+        df = self.server_service.get_server_history(server_id)
+        self._send_raw(200, f'{{"items": {_records_json(df)}}}')
+
+    # --- 共通処理 ---
+
+    def _authenticate(self):
+        """Bearer トークンの確認"""
+        header = self.headers.get('Authorization', '')
+        token = header.removeprefix('Bearer ').strip()
+        if not API_TOKEN or not hmac.compare_digest(token.encode(), API_TOKEN.encode()):
+            raise APIError(401, "認証が必要です。")
+
+    def _require_server(self, server_id: int) -> Dict[str, Any]:
+        """サーバの取得（存在しない場合は 404）"""
+        server = self.server_service.get_server_by_id(server_id)
+        if server is None:
+            raise APIError(404, "サーバが見つかりません。")
+        return server
+
+    def _read_json(self, expected_type: type):
+        """リクエストボディの JSON を読み込み"""
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'null')
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise APIError(400, "JSON を解析できません。")
+        if not isinstance(body, expected_type):
+            raise APIError(400, "リクエストボディの形式が正しくありません。")
+        return body
+
+    def _send_precondition_failed(self, current: Dict[str, Any]):
+        """412（最新のバージョンを ETag で返す）"""
+        self._send_json(412, {
+            'error': "他のユーザーが先に更新しました。",
+            'current': current,
+        }, {'ETag': _version_etag(current['version'])})
+
+    def _send_not_modified(self, etag: str):
+        """304"""
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.end_headers()
+
+    def _send_json(self, status: int, payload: Any, headers: Dict[str, str] = None):
+        """JSON レスポンス"""
+        self._send_raw(status, json.dumps(payload, ensure_ascii=False, default=str), headers)
+
+    def _send_raw(self, status: int, body: str, headers: Dict[str, str] = None):
+        """JSON 文字列のレスポンス"""
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def create_server(host: str = API_HOST, port: int = API_PORT) -> ThreadingHTTPServer:
+    """API サーバの作成"""
+    if not API_TOKEN:
+        raise RuntimeError("API_TOKEN が設定されていません。")
+    init_database()
+    return ThreadingHTTPServer((host, port), InventoryAPIHandler)
+
+
+def main(argv: list[str] = None):
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="サーバ在庫管理 JSON API")
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    args = parser.parse_args(argv)
+
+    httpd = create_server(args.host, args.port)
+    print(f"API サーバを起動しました: http://{args.host}:{args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
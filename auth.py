@@ -2,13 +2,16 @@
 認証管理モジュール
 """
 import streamlit as st
-from typing import Optional, Dict, Any
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, Iterator
 from datetime import datetime
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
 
 from config import GOOGLE_CLIENT_ID
-from database import get_db_connection
+from repositories import UserRepository
+
+# Streamlit のセッション外（API・バックグラウンド処理）で操作するユーザー
+_acting_user: ContextVar[Optional[str]] = ContextVar('acting_user', default=None)
 
 
 class AuthManager:
@@ -17,6 +20,10 @@ class AuthManager:
     @staticmethod
     def verify_google_token(token: str) -> Optional[Dict[str, Any]]:
         """Google ID トークンの検証"""
+        # google-auth は読み込みが重いため、実際に検証するときだけ読み込む
+        from google.oauth2 import id_token
+        from google.auth.transport import requests as google_requests
+
         try:
             idinfo = id_token.verify_oauth2_token(
                 token, google_requests.Request(), GOOGLE_CLIENT_ID
@@ -28,17 +35,9 @@ class AuthManager:
     @staticmethod
     def login_user(user_info: Dict[str, Any]):
         """ユーザー情報の登録・更新とセッション設定"""
-        with get_db_connection() as conn:
-            conn.execute('''
-                INSERT OR REPLACE INTO users (email, name, picture_url, last_login)
-                VALUES (?, ?, ?, ?)
-            ''', (
-                user_info['email'],
-                user_info['name'],
-                user_info.get('picture', ''),
-                datetime.now()
-            ))
-            conn.commit()
+        UserRepository.current().upsert(
+            user_info['email'], user_info['name'], user_info.get('picture', ''), datetime.now()
+        )
 
         st.session_state.user_email = user_info['email']
         st.session_state.user_name = user_info['name']
@@ -56,6 +55,21 @@ class AuthManager:
         """認証状態の確認"""
         return 'user_email' in st.session_state
 
+    @staticmethod
+    def get_current_email() -> Optional[str]:
+        """変更者として記録するメールアドレスの取得"""
+        return _acting_user.get() or st.session_state.get('user_email')
+
+    @staticmethod
+    @contextmanager
+    def acting_as(email: str) -> Iterator[None]:
+        """セッション外の処理を指定ユーザーとして実行"""
+        token = _acting_user.set(email)
+        try:
+            yield
+        finally:
+            _acting_user.reset(token)
+
     @staticmethod
     def get_current_user() -> Dict[str, str]:
         """現在のユーザー情報を取得"""
@@ -0,0 +1,102 @@
+"""
+サーバカードの表示内容キャッシュモジュール
+
+サーバ一覧のカードの表示内容（1つの HTML ブロック）を (サーバID, バージョン) ごとに保持する。
+カードの内容はサーバの行が更新されてバージョンが変わったときだけ変わるため、
+再実行時に組み立て直すのは前回から変更されたサーバのカードだけになる。
+キャッシュはプロセス共通で、CARD_CACHE_SIZE 件を超えると最も長く使われていないものから破棄する。
+"""
+import html
+import threading
+from collections import OrderedDict
+from typing import Dict, Any
+
+import pandas as pd
+
+from config import CARD_CACHE_SIZE
+
+
+def _display(value: Any) -> str:
+    """表示用の文字列（未設定は「-」。HTML として安全な形に変換）"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)) or value == '':
+        return '-'
+    return html.escape(str(value)).replace('\n', '<br>')
+
+
+def _updater(server: pd.Series) -> str:
+    """更新者の表示名（ユーザー名の変更はバージョンを変えないため、キャッシュの照合にも使う）"""
+    for column in ('updated_by_name', 'updated_by'):
+        value = _display(server.get(column))
+        if value != '-':
+            return value
+    return '-'
+
+
+class CardCache:
+    """サーバカードの HTML を (ID, バージョン) ごとに保持する LRU キャッシュ"""
+
+    _entries: 'OrderedDict[tuple[int, int], tuple[str, str]]' = OrderedDict()
+    _lock = threading.Lock()
+    _hits = 0
+    _misses = 0
+
+    @classmethod
+    def get(cls, server: pd.Series) -> str:
+        """カードの HTML の取得（キャッシュになければ組み立てて保持）"""
+        key = (int(server['id']), int(server['version']))
+        updater = _updater(server)
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is not None and entry[0] == updater:
+                cls._entries.move_to_end(key)
+                cls._hits += 1
+                return entry[1]
+            cls._misses += 1
+
+        content = CardCache.build(server)
+        with cls._lock:
+            cls._entries[key] = (updater, content)
+            cls._entries.move_to_end(key)
+            while len(cls._entries) > CARD_CACHE_SIZE:
+                cls._entries.popitem(last=False)
+        return content
+
+    @staticmethod
+    def build(server: pd.Series) -> str:
+        """カードの HTML の組み立て（改行を含めず、1回の st.markdown で表示できる形にする）"""
+        warranty_color = "🟢" if server['warranty_status'] == "有効" else "🔴"
+        columns = [
+            [('設置場所', _display(server['location'])), ('利用者', _display(server['user_name']))],
+            [('ホスト名', _display(server['hostname'])), ('IPアドレス', _display(server['ip_address'])),
+             ('OS', _display(server['os']))],
+            [('保守契約', f"{warranty_color} {_display(server['warranty_status'])}"),
+             ('保守期限', _display(server['warranty_end_date'])),
+             ('GPU・付属品', _display(server['gpu_accessories']))],
+            [('購入日', _display(server['purchase_date'])), ('更新者', _updater(server))],
+        ]
+        body = ''.join(
+            '<div style="flex: 1; min-width: 0">'
+            + '<br>'.join(f'<b>{label}:</b> {value}' for label, value in items)
+            + '</div>'
+            for items in columns
+        )
+        notes = _display(server['notes'])
+        return (
+            f'<div class="server-card"><h3>🖥️ {_display(server["model"])}</h3>'
+            f'<div style="display: flex; gap: 1rem">{body}</div>'
+            + (f'<p><b>備考:</b> {notes}</p>' if notes != '-' else '')
+            + '</div>'
+        )
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """保持件数・ヒット数・ミス数・ヒット率の取得"""
+        with cls._lock:
+            requests = cls._hits + cls._misses
+            return {
+                'entries': len(cls._entries),
+                'capacity': CARD_CACHE_SIZE,
+                'hits': cls._hits,
+                'misses': cls._misses,
+                'hit_rate': cls._hits / requests if requests else 0.0,
+            }
@@ -0,0 +1,154 @@
+"""
+マルチプロセス構成でのキャッシュ整合性チェック
+
+同じデータベースファイルを共有するワーカープロセスを複数起動し、
+各ワーカーがキャッシュ経由の読み取り（DatabaseManager.get_servers）で
+
+- 自分の書き込みを直後に読めること（read-your-writes）
+- 他のワーカーの書き込みがどれだけの時間で見えるようになるか（収束時間）
+
+を確認する。本番のデータベースは使わず、一時ディレクトリに作成したデータベースで実行する。
+
+    python coherence_check.py --workers 4 --rounds 50
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import time
+
+POLL_INTERVAL = 0.002
+
+
+def _worker(index: int, workdir: str, commands, reports):
+    """ワーカープロセス: コマンドを待ちながらキャッシュ経由でサーバ一覧を読み続ける"""
+    os.chdir(workdir)
+    from auth import AuthManager
+    from database import DatabaseManager
+
+    def read_model() -> str:
+        servers = DatabaseManager.get_servers()
+        return servers.loc[servers['id'] == 1, 'model'].iloc[0]
+
+    last_seen = read_model()
+    reports.put(('ready', index, last_seen, time.time(), True))
+    with AuthManager.acting_as(f"worker{index}@example.com"):
+        while True:
+            try:
+                command = commands.get_nowait()
+            except queue.Empty:
+                command = None
+
+            if command == 'stop':
+                return
+            if command is not None:
+                server = dict(DatabaseManager.get_server_by_id(1))
+                written_at = time.time()
+                updated = DatabaseManager.update_server(1, {**server, 'model': command}, server['version'])
+                observed = read_model()
+                reports.put(('write', index, command, written_at, updated and observed == command))
+                last_seen = observed
+
+            model = read_model()
+            if model != last_seen:
+                reports.put(('seen', index, model, time.time(), True))
+                last_seen = model
+            time.sleep(POLL_INTERVAL)
+
+
+def run(workers: int, rounds: int, timeout: float) -> int:
+    """整合性チェックの実行（問題があれば 1 を返す）"""
+    workdir = tempfile.mkdtemp(prefix="coherence_")
+    os.chdir(workdir)
+    from db_core import init_database
+    from database import DatabaseManager
+    init_database()
+    DatabaseManager.add_server({
+        'model': 'initial', 'location': 'coherence-check', 'purchase_date': None,
+        'warranty_status': None, 'ip_address': None, 'user_name': None, 'os': None,
+        'gpu_accessories': None, 'notes': None,
+    })
+
+    context = multiprocessing.get_context('spawn')
+    reports = context.Queue()
+    command_queues = [context.Queue() for _ in range(workers)]
+    processes = [
+        context.Process(target=_worker, args=(i, workdir, command_queues[i], reports), daemon=True)
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    failures = []
+    latencies = []
+    try:
+        # 全ワーカーが初回の読み取り（キャッシュ作成）を終えてから書き込みを始める
+        for _ in range(workers):
+            reports.get(timeout=60)
+
+        for round_no in range(rounds):
+            writer = round_no % workers
+            value = f"round-{round_no}-w{writer}"
+            command_queues[writer].put(value)
+
+            written_at = None
+            seen_at = {}
+            pending = set(range(workers)) - {writer}
+            deadline = time.monotonic() + timeout
+            while written_at is None or pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    failures.append(f"{value}: 未収束のワーカー {sorted(pending)}")
+                    break
+                try:
+                    kind, index, model, at, ok = reports.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+                if model != value:
+                    continue
+                if kind == 'write':
+                    written_at = at
+                    if not ok:
+                        failures.append(f"{value}: ワーカー{index} が自分の書き込みを読めませんでした")
+                elif index in pending:
+                    pending.discard(index)
+                    seen_at[index] = at
+
+            # 収束時間は書き込み時刻からの差分
+            if written_at is not None:
+                latencies.extend(at - written_at for at in seen_at.values())
+    finally:
+        for command_queue in command_queues:
+            command_queue.put('stop')
+        for process in processes:
+            process.join(timeout=5)
+
+    print(f"ワーカー数: {workers}、書き込み回数: {rounds}")
+    if latencies:
+        ordered = sorted(latencies)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        print(
+            f"収束時間: 中央値 {statistics.median(ordered) * 1000:.1f} ms、"
+            f"95% {p95 * 1000:.1f} ms、最大 {ordered[-1] * 1000:.1f} ms"
+        )
+    print(f"read-your-writes 違反・未収束: {len(failures)} 件")
+    for failure in failures[:20]:
+        print(f"  {failure}")
+    return 1 if failures else 0
+
+
+def main(argv: list[str] = None) -> int:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="マルチプロセス構成でのキャッシュ整合性チェック")
+    parser.add_argument('--workers', type=int, default=4, help="ワーカープロセス数")
+    parser.add_argument('--rounds', type=int, default=50, help="書き込み回数")
+    parser.add_argument('--timeout', type=float, default=5.0, help="1回の書き込みが全ワーカーに見えるまでの上限（秒）")
+    args = parser.parse_args(argv)
+    return run(args.workers, args.rounds, args.timeout)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,80 +1,16 @@
 """
 データベース操作モジュール
+
+SQL はリポジトリ（repositories）が持ち、ここでは結果のキャッシュと変更者の設定を行う。
 """
-import sqlite3
 import streamlit as st
-from contextlib import contextmanager
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator
 import pandas as pd
-from datetime import datetime
-
-from config import DATABASE_PATH
-
-
-@st.cache_resource
-def init_database():
-    """データベースの初期化"""
-    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
-
-    # サーバテーブル
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS servers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            model TEXT NOT NULL,
-            location TEXT NOT NULL,
-            purchase_date DATE,
-            warranty_status TEXT,
-            ip_address TEXT,
-            user_name TEXT,
-            os TEXT,
-            gpu_accessories TEXT,
-            notes TEXT,
-            version INTEGER DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_by TEXT,
-            updated_by TEXT
-        )
-    ''')
-
-    # 編集履歴テーブル
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS edit_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            server_id INTEGER,
-            action TEXT NOT NULL,
-            field_name TEXT,
-            old_value TEXT,
-            new_value TEXT,
-            changed_by TEXT,
-            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (server_id) REFERENCES servers (id)
-        )
-    ''')
-
-    # ユーザーテーブル
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            email TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            picture_url TEXT,
-            last_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
 
-    conn.commit()
-    return conn
-
-
-@contextmanager
-def get_db_connection():
-    """データベース接続のコンテキストマネージャー"""
-    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-    finally:
-        conn.close()
+from db_core import get_generations
+from repositories import ServerRepository, UserRepository, HistoryRepository
+from storage import get_backend
+from auth import AuthManager
 
 
 class DatabaseManager:
@@ -83,111 +19,153 @@ class DatabaseManager:
     @staticmethod
     def get_servers() -> pd.DataFrame:
         """全サーバ情報の取得"""
-        with get_db_connection() as conn:
-            df = pd.read_sql_query('''
-                SELECT
-                    s.*,
-                    u_created.name as created_by_name,
-                    u_updated.name as updated_by_name
-                FROM servers s
-                LEFT JOIN users u_created ON s.created_by = u_created.email
-                LEFT JOIN users u_updated ON s.updated_by = u_updated.email
-                ORDER BY s.id DESC
-            ''', conn)
-            return df
-
-    @staticmethod
-    def get_server_by_id(server_id: int) -> Optional[sqlite3.Row]:
+        return DatabaseManager.query_servers('', [])
+
+    @staticmethod
+    def query_servers(where_clause: str, params: list, limit: int = None) -> pd.DataFrame:
+        """条件に一致するサーバ情報の取得（WHERE 句はパラメータ化済みであること）
+
+        結果は接続先とデータ世代ごとにキャッシュするため、他プロセスの書き込み後も古い結果は返さない。
+        """
+        generations = get_generations()
+        return DatabaseManager._query_servers_cached(
+            get_backend().key, generations.get('servers', 0), generations.get('users', 0),
+            generations.get('server_components', 0), where_clause, tuple(params), limit
+        )
+
+    @staticmethod
+    @st.cache_data(max_entries=16, show_spinner=False)
+    def _query_servers_cached(backend_key: str, servers_generation: int, users_generation: int,
+                              components_generation: int, where_clause: str, params: tuple,
+                              limit: Optional[int]) -> pd.DataFrame:
+        """サーバ情報の取得（接続先・世代引数はキャッシュキーとしてのみ使用）"""
+        return ServerRepository.current().select_frame(where_clause, params, limit)
+
+    @staticmethod
+    def get_generation(name: str = 'servers') -> int:
+        """データ世代の取得（テーブルが変更されるたびに増加）"""
+        return get_generations().get(name, 0)
+
+    @staticmethod
+    def get_facet_counts(count_query: str, params: list) -> pd.DataFrame:
+        """ファセット件数の取得（接続先とデータ世代ごとにキャッシュ）"""
+        generations = get_generations()
+        return DatabaseManager._get_facet_counts_cached(
+            get_backend().key, generations.get('servers', 0), generations.get('server_components', 0),
+            count_query, tuple(params)
+        )
+
+    @staticmethod
+    @st.cache_data(max_entries=256, show_spinner=False)
+    def _get_facet_counts_cached(backend_key: str, generation: int, components_generation: int,
+                                 count_query: str, params: tuple) -> pd.DataFrame:
+        """ファセット件数の取得（接続先・世代引数はキャッシュキーとしてのみ使用）"""
+        return ServerRepository.current().read_frame(count_query, params)
+
+    @staticmethod
+    def get_location_counts(where_clause: str, params: list) -> pd.DataFrame:
+        """設置場所のパスごとの台数（location_path, location, count 列。location は表記の例）"""
+        generations = get_generations()
+        return DatabaseManager._get_location_counts_cached(
+            get_backend().key, generations.get('servers', 0), generations.get('server_components', 0),
+            where_clause, tuple(params)
+        )
+
+    @staticmethod
+    @st.cache_data(max_entries=64, show_spinner=False)
+    def _get_location_counts_cached(backend_key: str, generation: int, components_generation: int,
+                                    where_clause: str, params: tuple) -> pd.DataFrame:
+        """設置場所のパスごとの台数（接続先・世代引数はキャッシュキーとしてのみ使用）"""
+        return ServerRepository.current().location_counts_frame(where_clause, params)
+
+    @staticmethod
+    def iter_servers(chunksize: int, where_clause: str = '', params: list = None) -> Iterator[pd.DataFrame]:
+        """サーバ情報をチャンク単位で取得（条件指定は query_servers と同じ）"""
+        yield from ServerRepository.current().iter_frames(chunksize, where_clause, params or [])
+
+    @staticmethod
+    def get_server_by_id(server_id: int) -> Optional[Any]:
         """特定のサーバ情報を取得"""
-        with get_db_connection() as conn:
-            return conn.execute('SELECT * FROM servers WHERE id = ?', (server_id,)).fetchone()
+        return ServerRepository.current().get(server_id)
 
     @staticmethod
     def add_server(server_data: Dict[str, Any]) -> int:
-        """新規サーバの追加"""
-        with get_db_connection() as conn:
-            cursor = conn.execute('''
-                INSERT INTO servers (
-                    model, location, purchase_date, warranty_status,
-                    ip_address, user_name, os, gpu_accessories, notes,
-                    created_by, updated_by
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                server_data['model'],
-                server_data['location'],
-                server_data['purchase_date'],
-                server_data['warranty_status'],
-                server_data['ip_address'],
-                server_data['user_name'],
-                server_data['os'],
-                server_data['gpu_accessories'],
-                server_data['notes'],
-                st.session_state.user_email,
-                st.session_state.user_email
-            ))
-
-            server_id = cursor.lastrowid
-            conn.commit()
-            return server_id
+        """新規サーバの追加（server_data に id があればその ID で登録）"""
+        return ServerRepository.current().insert(server_data, AuthManager.get_current_email())
 
     @staticmethod
     def update_server(server_id: int, new_data: Dict[str, Any], expected_version: int) -> bool:
         """サーバ情報の更新（楽観的ロック）"""
-        with get_db_connection() as conn:
-            # バージョンチェックと更新を同時に実行
-            cursor = conn.execute('''
-                UPDATE servers SET
-                    model = ?, location = ?, purchase_date = ?, warranty_status = ?,
-                    ip_address = ?, user_name = ?, os = ?, gpu_accessories = ?, notes = ?,
-                    version = version + 1,
-                    updated_by = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE id = ? AND version = ?
-            ''', (
-                new_data['model'],
-                new_data['location'],
-                new_data['purchase_date'],
-                new_data['warranty_status'],
-                new_data['ip_address'],
-                new_data['user_name'],
-                new_data['os'],
-                new_data['gpu_accessories'],
-                new_data['notes'],
-                st.session_state.user_email,
-                server_id,
-                expected_version
-            ))
-
-            # 更新された行数をチェック
-            if cursor.rowcount == 0:
-                # バージョンが一致しない（他のユーザーが先に更新した）
-                return False
-
-            conn.commit()
-            return True
-
-    @staticmethod
-    def delete_server(server_id: int):
-        """サーバの削除"""
-        with get_db_connection() as conn:
-            # サーバ情報取得（履歴用）
-            server = conn.execute('SELECT model FROM servers WHERE id = ?', (server_id,)).fetchone()
-
-            # 削除実行
-            conn.execute('DELETE FROM servers WHERE id = ?', (server_id,))
-            conn.commit()
-
-            return server['model'] if server else None
+        return ServerRepository.current().update(
+            server_id, new_data, expected_version, AuthManager.get_current_email()
+        )
+
+    @staticmethod
+    def bulk_update_fields(updates: list[tuple[int, int, Dict[str, Any]]]) -> list[int]:
+        """複数サーバの項目を1トランザクションで更新（楽観的ロック）
+
+        updates: (server_id, expected_version, {項目名: 新しい値}) のリスト
+        バージョンが一致しない行はスキップし、更新できた server_id のリストを返す。
+        """
+        return ServerRepository.current().bulk_update_fields(updates, AuthManager.get_current_email())
+
+    @staticmethod
+    def refresh_warranty_status() -> list[tuple]:
+        """保守期限による保守契約状態の一括判定（状態を変更したサーバの履歴レコードを返す）"""
+        return ServerRepository.current().refresh_warranty_status(AuthManager.get_current_email())
+
+    @staticmethod
+    def get_server_identities() -> pd.DataFrame:
+        """照合用にサーバの識別項目のみ取得"""
+        return ServerRepository.current().identities_frame()
+
+    @staticmethod
+    def delete_server(server_id: int, expected_version: int = None):
+        """サーバの削除（expected_version 指定時はバージョン一致時のみ削除）"""
+        return ServerRepository.current().delete(server_id, expected_version)
 
     @staticmethod
     def get_statistics() -> Dict[str, int]:
         """統計情報の取得"""
-        with get_db_connection() as conn:
-            server_count = conn.execute('SELECT COUNT(*) as count FROM servers').fetchone()['count']
-            history_count = conn.execute('SELECT COUNT(*) as count FROM edit_history').fetchone()['count']
-            user_count = conn.execute('SELECT COUNT(*) as count FROM users').fetchone()['count']
-
-            return {
-                'servers': server_count,
-                'history': history_count,
-                'users': user_count
-             }
+        generations = get_generations()
+        return DatabaseManager._get_statistics_cached(
+            get_backend().key, generations.get('servers', 0),
+            generations.get('edit_history', 0), generations.get('users', 0)
+        )
+
+    @staticmethod
+    @st.cache_data(max_entries=64, show_spinner=False)
+    def _get_statistics_cached(backend_key: str, servers_generation: int, history_generation: int,
+                               users_generation: int) -> Dict[str, int]:
+        """統計情報の取得（接続先・世代引数はキャッシュキーとしてのみ使用）"""
+        return {
+            'servers': ServerRepository.current().count(),
+            'history': HistoryRepository.current().count(),
+            'users': UserRepository.current().count()
+        }
+
+    @staticmethod
+    def get_gpu_totals() -> pd.DataFrame:
+        """設置場所・型番別の GPU 搭載数（location, model, servers, gpus, memory_gb 列）"""
+        generations = get_generations()
+        return DatabaseManager._get_gpu_totals_cached(
+            get_backend().key, generations.get('servers', 0), generations.get('server_components', 0)
+        )
+
+    @staticmethod
+    @st.cache_data(max_entries=16, show_spinner=False)
+    def _get_gpu_totals_cached(backend_key: str, servers_generation: int,
+                               components_generation: int) -> pd.DataFrame:
+        """設置場所・型番別の GPU 搭載数（接続先・世代引数はキャッシュキーとしてのみ使用）"""
+        return ServerRepository.current().gpu_totals_frame()
+
+    @staticmethod
+    def get_user_names() -> Dict[str, str]:
+        """メールアドレスと表示名の対応の取得"""
+        return DatabaseManager._get_user_names_cached(get_backend().key, get_generations().get('users', 0))
+
+    @staticmethod
+    @st.cache_data(max_entries=16, show_spinner=False)
+    def _get_user_names_cached(backend_key: str, users_generation: int) -> Dict[str, str]:
+        """メールアドレスと表示名の対応の取得（接続先・世代引数はキャッシュキーとしてのみ使用）"""
+        return UserRepository.current().names()
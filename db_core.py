@@ -0,0 +1,95 @@
+"""
+データベース接続・スキーマ初期化モジュール
+
+ログイン画面の表示に必要な最小限の処理のみを持ち、pandas などの重いモジュールに依存しない。
+接続・スキーマ・方言の差は storage モジュールのバックエンドが吸収する。
+"""
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+
+from config import JOB_HEARTBEAT_TIMEOUT_SECONDS
+from storage import get_backend, get_default_backend
+
+_init_lock = threading.Lock()
+_initialized = False
+
+# ジョブを実行するプロセスの識別子（jobs.owner）
+JOB_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def init_database():
+    """データベースの初期化（プロセスごとに1回）"""
+    global _initialized
+    if _initialized:
+        return
+
+    with _init_lock:
+        if _initialized:
+            return
+
+        get_default_backend().init_schema()
+        sweep_orphaned_jobs()
+
+        _initialized = True
+
+
+def _owner_alive(owner: Optional[str], heartbeat: Optional[float]) -> bool:
+    """ジョブを実行するプロセスが生存しているか
+
+    同じホストのプロセスは PID でも確認し、生存確認の時刻が途絶えたものは終了したとみなす。
+    """
+    if not owner or heartbeat is None:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host == socket.gethostname() and pid.isdigit():
+        try:
+            os.kill(int(pid), 0)
+        except PermissionError:
+            pass
+        except OSError:
+            return False
+    return time.time() - heartbeat < JOB_HEARTBEAT_TIMEOUT_SECONDS
+
+
+def sweep_orphaned_jobs() -> int:
+    """実行プロセスが終了したジョブを中断扱いにする（他のプロセスで実行中のジョブはそのまま）"""
+    with get_db_connection() as conn:
+        orphaned = [
+            (row['id'],) for row in conn.execute(
+                "SELECT id, owner, heartbeat FROM jobs WHERE status IN ('PENDING', 'RUNNING')"
+            ).fetchall()
+            if not _owner_alive(row['owner'], row['heartbeat'])
+        ]
+        if orphaned:
+            conn.executemany('''
+                UPDATE jobs SET status = 'INTERRUPTED', finished_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status IN ('PENDING', 'RUNNING')
+            ''', orphaned)
+        conn.commit()
+    return len(orphaned)
+
+
+@contextmanager
+def get_db_connection():
+    """データベース接続のコンテキストマネージャー"""
+    with get_backend().connect() as conn:
+        yield conn
+
+
+def read_frame(query: str, params: Iterable = ()):
+    """クエリ結果を DataFrame で取得"""
+    return get_backend().read_frame(query, params)
+
+
+def iter_frames(query: str, params: Iterable, chunksize: int) -> Iterator:
+    """クエリ結果をチャンク単位の DataFrame で取得"""
+    return get_backend().iter_frames(query, params, chunksize)
+
+
+def get_generations() -> Dict[str, int]:
+    """テーブルごとのデータ世代を取得（リクエストごとに呼び出せる程度に軽い）"""
+    return get_backend().get_generations()
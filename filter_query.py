@@ -0,0 +1,387 @@
+"""
+サーバ検索フィルタ構文の解析・SQL変換モジュール
+
+例: location:東京DC os:ubuntu* warranty:期限切れ purchased<2020-01-01 ip:10.0.0.0/8 -user:山田
+日付は今日からの日数でも指定できる（expires>=0d expires<=30d は30日以内に保守期限を迎える、expires<0d は期限切れ）。
+"""
+import ipaddress
+import re
+from datetime import date, timedelta
+from typing import NamedTuple, Optional, Dict, Any, Callable
+
+from accessories import AccessoryParser
+from config import FIELD_MAPPING
+from location_tree import LocationTree
+
+
+class FilterSyntaxError(ValueError):
+    """フィルタ構文エラー"""
+
+
+class FilterTerm(NamedTuple):
+    """フィルタの1条件"""
+    field: Optional[str]  # None はフリーテキスト
+    op: str
+    value: str
+    negate: bool
+
+
+# フィルタ名 -> (カラム名, 種別)
+# text は大文字小文字を区別しないインデックス（COLLATE NOCASE / citext）、date / ip / int / path は通常インデックスを利用する
+FILTER_FIELDS = {
+    'id': ('id', 'int'),
+    'model': ('model', 'text'),
+    'location': ('location', 'text'),
+    'loc': ('location', 'text'),
+    'under': ('location_path', 'path'),
+    'os': ('os', 'text'),
+    'warranty': ('warranty_status', 'text'),
+    'expires': ('warranty_end_date', 'date'),
+    'warranty_end': ('warranty_end_date', 'date'),
+    'user': ('user_name', 'text'),
+    'gpu': ('gpu_accessories', 'text'),
+    'notes': ('notes', 'text'),
+    'purchased': ('purchase_date', 'date'),
+    'purchase_date': ('purchase_date', 'date'),
+    'ip': ('ip_address', 'ip'),
+    'host': ('hostname', 'text'),
+    'hostname': ('hostname', 'text'),
+    'mac': ('mac_address', 'text'),
+}
+# 日本語の項目名（設置場所:東京DC など）も受け付ける
+_COLUMN_KINDS = {column: kind for column, kind in FILTER_FIELDS.values()}
+FILTER_FIELDS.update({
+    label: (column, _COLUMN_KINDS.get(column, 'text'))
+    for column, label in FIELD_MAPPING.items()
+})
+# GPU 搭載数（server_components の集計。gpus>=4 は合計、gpus:A100>=2 は型番別、gpus:H100 は1枚以上）
+FILTER_FIELDS['gpus'] = ('id', 'gpus')
+
+# フリーテキスト検索の対象カラム
+FREE_TEXT_COLUMNS = [
+    'model', 'location', 'purchase_date', 'warranty_status', 'warranty_end_date', 'ip_address',
+    'hostname', 'mac_address', 'user_name', 'os', 'gpu_accessories', 'notes'
+]
+
+_TOKEN_PATTERN = re.compile(
+    r'(?P<negate>-)?'
+    r'(?:(?P<field>[^\s:<>="-][^\s:<>="]*)(?P<op><=|>=|<|>|:|=))?'
+    r'(?:"(?P<quoted>[^"]*)"|(?P<bare>\S+))'
+)
+_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_RELATIVE_DATE_PATTERN = re.compile(r'^(?P<days>[+-]?\d+)d$', re.IGNORECASE)
+_GPU_CONDITION_PATTERN = re.compile(r'^(?P<model>[^<>=]*?)(?:(?P<op><=|>=|<|>|=)(?P<count>\d+))?$')
+
+
+def ip_in_network(ip: Optional[str], network: str) -> int:
+    """IPアドレスがネットワークに含まれるか（SQL関数として登録）"""
+    if not ip:
+        return 0
+    try:
+        return int(ipaddress.ip_address(ip.strip()) in ipaddress.ip_network(network, strict=False))
+    except ValueError:
+        return 0
+
+
+# 接続ごとに登録が必要な SQL 関数: 名前 -> (引数の数, 関数)
+SQL_FUNCTIONS: Dict[str, tuple[int, Callable[..., Any]]] = {
+    'ip_in_network': (2, ip_in_network),
+}
+
+
+def _dialect():
+    """現在のバックエンド（大文字小文字を区別しない比較の nocase / like 属性を持つ）
+
+    storage が本モジュールを読み込むため、呼び出し時に読み込む。
+    """
+    from storage import get_backend
+    return get_backend()
+
+
+class FilterQuery:
+    """フィルタ構文の解析とパラメータ化SQLへの変換を行うクラス"""
+
+    @staticmethod
+    def parse(text: str) -> list[FilterTerm]:
+        """フィルタ文字列を条件のリストに分解"""
+        terms = []
+        for match in _TOKEN_PATTERN.finditer(text or ''):
+            value = match.group('quoted') if match.group('quoted') is not None else match.group('bare')
+            field = match.group('field')
+            op = match.group('op') or ':'
+            negate = bool(match.group('negate'))
+
+            if field is not None:
+                field = field.lower() if field.isascii() else field
+                if field not in FILTER_FIELDS:
+                    raise FilterSyntaxError(
+                        f"不明な項目「{field}」です。使用可能: {', '.join(sorted(k for k in FILTER_FIELDS if k.isascii() and k.islower()))}"
+                    )
+            if value == '':
+                raise FilterSyntaxError(f"「{match.group(0)}」の値が空です。")
+
+            terms.append(FilterTerm(field, op, value, negate))
+        return terms
+
+    @staticmethod
+    def compile(terms: list[FilterTerm]) -> tuple[str, list]:
+        """条件のリストを WHERE 句とパラメータに変換（全条件を AND で結合）"""
+        clauses = []
+        params = []
+        for term in terms:
+            if term.field is None:
+                clause, clause_params = FilterQuery._compile_free_text(term.value)
+            else:
+                column, kind = FILTER_FIELDS[term.field]
+                compiler = {
+                    'text': FilterQuery._compile_text,
+                    'date': FilterQuery._compile_date,
+                    'ip': FilterQuery._compile_ip,
+                    'int': FilterQuery._compile_int,
+                    'gpus': FilterQuery._compile_gpus,
+                    'path': FilterQuery._compile_path,
+                }[kind]
+                clause, clause_params = compiler(column, term.op, term.value)
+
+            if term.negate:
+                column = FILTER_FIELDS[term.field][0] if term.field else None
+                null_check = f's.{column} IS NULL OR ' if column else ''
+                clause = f'({null_check}NOT ({clause}))'
+
+            clauses.append(clause)
+            params.extend(clause_params)
+
+        if not clauses:
+            return '', []
+        return ' AND '.join(clauses), params
+
+    @staticmethod
+    def to_sql(text: str) -> tuple[str, list]:
+        """フィルタ文字列を直接 WHERE 句とパラメータに変換"""
+        return FilterQuery.compile(FilterQuery.parse(text))
+
+    @staticmethod
+    def _escape_like(value: str) -> str:
+        """LIKE 用のエスケープ"""
+        return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    @staticmethod
+    def _compile_range(column: str, op: str, value: str, collate: str = '') -> tuple[str, list]:
+        """比較演算子による範囲条件"""
+        sql_op = {'<': '<', '>': '>', '<=': '<=', '>=': '>=', ':': '=', '=': '='}[op]
+        return f's.{column}{collate} {sql_op} ?', [value]
+
+    @staticmethod
+    def _compile_text(column: str, op: str, value: str, nocase: bool = True) -> tuple[str, list]:
+        """文字列項目の条件（既定では大文字小文字を区別しない）
+
+        大文字小文字を区別しない前方一致は LIKE で判定する（SQLite では NOCASE インデックスの範囲検索になる）。
+        """
+        if '*' not in value:
+            return FilterQuery._compile_range(column, op, value, _dialect().nocase if nocase else '')
+
+        if op not in (':', '='):
+            raise FilterSyntaxError(f"ワイルドカードは「{op}」と併用できません: {value}")
+
+        prefix = value[:-1]
+        if value.endswith('*') and '*' not in prefix:
+            if not prefix:
+                return f's.{column} IS NOT NULL', []
+            if not nocase:
+                # 区別する項目の前方一致はインデックスの範囲検索に変換する
+                prefix = prefix.lower()
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                return f's.{column} >= ? AND s.{column} < ?', [prefix, upper]
+
+        pattern = FilterQuery._escape_like(value).replace('*', '%')
+        return f"s.{column} {_dialect().like} ? ESCAPE '\\'", [pattern]
+
+    @staticmethod
+    def _compile_date(column: str, op: str, value: str) -> tuple[str, list]:
+        """日付項目の条件（YYYY / YYYY-MM / YYYY-MM-DD / 今日からの日数 Nd）"""
+        relative = _RELATIVE_DATE_PATTERN.match(value)
+        if relative:
+            value = (date.today() + timedelta(days=int(relative.group('days')))).isoformat()
+        elif re.fullmatch(r'\d{4}(-\d{2})?', value) and op in (':', '='):
+            # 年・年月指定は期間の範囲検索にする（DATE 列は数値アフィニティのため完全な日付で比較）
+            if len(value) == 4:
+                lower, upper = f"{value}-01-01", f"{int(value) + 1:04d}-01-01"
+            else:
+                year, month = map(int, value.split('-'))
+                if not 1 <= month <= 12:
+                    raise FilterSyntaxError(f"月は 01〜12 で指定してください: {value}")
+                lower = f"{year:04d}-{month:02d}-01"
+                upper = f"{year + month // 12:04d}-{month % 12 + 1:02d}-01"
+            return f's.{column} >= ? AND s.{column} < ?', [lower, upper]
+
+        if not _DATE_PATTERN.match(value):
+            raise FilterSyntaxError(f"日付は YYYY-MM-DD 形式または日数（30d など）で指定してください: {value}")
+        try:
+            date.fromisoformat(value)
+        except ValueError:
+            raise FilterSyntaxError(f"存在しない日付です: {value}")
+        return FilterQuery._compile_range(column, op, value)
+
+    @staticmethod
+    def _compile_int(column: str, op: str, value: str) -> tuple[str, list]:
+        """整数項目の条件"""
+        try:
+            number = int(value)
+        except ValueError:
+            raise FilterSyntaxError(f"数値を指定してください: {value}")
+        sql, _ = FilterQuery._compile_range(column, op, value)
+        return sql, [number]
+
+    @staticmethod
+    def _compile_path(column: str, op: str, value: str) -> tuple[str, list]:
+        """設置場所の階層の条件（指定したノードと配下。under:東京DC/B棟 は「東京DC / B棟 / R12」にも一致）"""
+        if op not in (':', '=') or '*' in value:
+            raise FilterSyntaxError(f"設置場所の階層は「under:サイト/建屋/...」の形式で指定してください: {value}")
+        path = LocationTree.path(value)
+        if not path:
+            raise FilterSyntaxError(f"設置場所の階層を指定してください: {value}")
+        lower, upper = LocationTree.subtree_range(path)
+        return f's.{column} >= ? AND s.{column} < ?', [lower, upper]
+
+    @staticmethod
+    def _compile_gpus(column: str, op: str, value: str) -> tuple[str, list]:
+        """GPU 搭載数の条件（型番は単語単位の前方一致: A100 は「A100 SXM4」にも一致）
+
+        部品テーブルのインデックス (type, model, server_id, count) で集計する。
+        GPU のないサーバも満たす条件（gpus<2 など）は、満たさないサーバの除外として組み立てる。
+        """
+        if op in (':', '='):
+            match = _GPU_CONDITION_PATTERN.match(value)
+            if match is None:
+                raise FilterSyntaxError(f"GPU の条件は「型番」「型番>=枚数」「枚数」のいずれかで指定してください: {value}")
+            model, op, count = match.group('model'), match.group('op') or '>=', match.group('count')
+            if count is None:
+                if model.isdigit():
+                    model, op, count = '', '=', model
+                else:
+                    count = '1'
+        else:
+            model, count = '', value
+            if not count.isdigit():
+                raise FilterSyntaxError(f"枚数を指定してください: {value}")
+
+        clause = "c.type = 'GPU'"
+        params = []
+        model = AccessoryParser.normalize_model(model) if model else None
+        if model:
+            # 「A100」と「A100 ...」を含み「A1000」を含まない範囲（空白の次の文字は「!」）
+            clause += ' AND c.model >= ? AND c.model < ?'
+            params.extend([model, f'{model}!'])
+
+        count = int(count)
+        matches_zero = {'<': 0 < count, '<=': 0 <= count, '>': False, '>=': count <= 0, '=': count == 0}[op]
+        having = f'SUM(c.count) {op} ?'
+        subquery = f'SELECT c.server_id FROM server_components c WHERE {clause} GROUP BY c.server_id'
+        if matches_zero:
+            return f's.{column} NOT IN ({subquery} HAVING NOT ({having}))', params + [count]
+        return f's.{column} IN ({subquery} HAVING {having})', params + [count]
+
+    @staticmethod
+    def _compile_ip(column: str, op: str, value: str) -> tuple[str, list]:
+        """IPアドレス項目の条件（単一アドレス / CIDR / 前方一致）"""
+        if op not in (':', '='):
+            raise FilterSyntaxError(f"IPアドレスには「:」を使用してください: {value}")
+        if '*' in value:
+            return FilterQuery._compile_text(column, op, value, nocase=False)
+        if '/' not in value:
+            return f's.{column} = ?', [value]
+
+        try:
+            network = ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            raise FilterSyntaxError(f"不正なネットワーク指定です: {value}")
+
+        if network.prefixlen == network.max_prefixlen:
+            return f's.{column} = ?', [str(network.network_address)]
+        if network.version != 4:
+            return f'ip_in_network(s.{column}, ?)', [str(network)]
+
+        # オクテット単位の接頭辞は文字列の範囲検索でインデックスを使う
+        octets = str(network.network_address).split('.')[:network.prefixlen // 8]
+        if not octets:
+            return f's.{column} IS NOT NULL', []
+        prefix = '.'.join(octets) + '.'
+        clause = f's.{column} >= ? AND s.{column} < ?'
+        params = [prefix, prefix[:-1] + '/']
+        if network.prefixlen % 8:
+            # 半端なプレフィックス長は範囲で絞った上で関数で判定
+            clause += f' AND ip_in_network(s.{column}, ?)'
+            params.append(str(network))
+        return clause, params
+
+    @staticmethod
+    def _compile_free_text(value: str) -> tuple[str, list]:
+        """フリーテキストの部分一致（全項目対象）
+
+        未設定の項目を空文字として比較し、除外（-語）の NOT が NULL にならないようにする。
+        """
+        pattern = f"%{FilterQuery._escape_like(value)}%"
+        like = _dialect().like
+        clause = ' OR '.join(f"COALESCE(s.{column}, '') {like} ? ESCAPE '\\'" for column in FREE_TEXT_COLUMNS)
+        return f'({clause})', [pattern] * len(FREE_TEXT_COLUMNS)
+
+
+# ファセット名 -> (表示名, 集計に使う式, 大文字小文字を区別しないか)
+FACET_FIELDS = {
+    'location': ('設置場所', 's.location', True),
+    'os': ('OS', 's.os', True),
+    'warranty_status': ('保守契約状態', 's.warranty_status', True),
+    'user_name': ('利用者名', 's.user_name', True),
+    'purchase_year': ('購入年', 'substr(s.purchase_date, 1, 4)', False),
+}
+
+
+class FacetQuery:
+    """ファセット選択条件のSQL変換と件数集計クエリの組み立てを行うクラス
+
+    未設定（NULL・空文字）の値は空文字として扱う。
+    """
+
+    @staticmethod
+    def compile(selections: Dict[str, list[str]], exclude: str = None) -> tuple[str, list]:
+        """ファセット選択を WHERE 句に変換（同一ファセット内は OR、ファセット間は AND）"""
+        clauses = []
+        params = []
+        for facet, values in selections.items():
+            if facet == exclude or not values or facet not in FACET_FIELDS:
+                continue
+            _, expr, nocase = FACET_FIELDS[facet]
+            collate = _dialect().nocase if nocase else ''
+            present = [value for value in values if value != '']
+            parts = []
+            if present:
+                parts.append(f"{expr}{collate} IN ({', '.join('?' * len(present))})")
+                params.extend(present)
+            if len(present) < len(values):
+                parts.append(f"COALESCE({expr}, '') = ''")
+            clauses.append(f"({' OR '.join(parts)})")
+        return ' AND '.join(clauses), params
+
+    @staticmethod
+    def build_count_query(base_where: str, base_params: list,
+                          selections: Dict[str, list[str]]) -> tuple[str, list]:
+        """全ファセットの件数を1回で集計する UNION ALL クエリの組み立て
+
+        各ファセットの件数は、自身以外のファセット選択と検索条件を適用した結果で数える。
+        """
+        branches = []
+        params = []
+        for facet, (_, expr, nocase) in FACET_FIELDS.items():
+            where_parts = [f'({base_where})'] if base_where else []
+            facet_where, facet_params = FacetQuery.compile(selections, exclude=facet)
+            if facet_where:
+                where_parts.append(facet_where)
+            where_sql = f" WHERE {' AND '.join(where_parts)}" if where_parts else ''
+            collate = _dialect().nocase if nocase else ''
+            branches.append(
+                f"SELECT '{facet}' AS facet, COALESCE({expr}, '') AS value, COUNT(*) AS count "
+                f"FROM servers s{where_sql} GROUP BY COALESCE({expr}, ''){collate}"
+            )
+            params.extend(base_params)
+            params.extend(facet_params)
+        return ' UNION ALL '.join(branches) + ' ORDER BY facet, count DESC, value', params
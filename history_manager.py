@@ -3,10 +3,11 @@
 """
 import streamlit as st
 import pandas as pd
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator
 
 from config import FIELD_MAPPING
-from database import get_db_connection
+from repositories import HistoryRepository
+from auth import AuthManager
 
 
 class HistoryManager:
@@ -16,43 +17,27 @@ class HistoryManager:
     def add_history_record(server_id: int, action: str, field_name: str = None,
                           old_value: str = None, new_value: str = None):
         """編集履歴の追加"""
-        with get_db_connection() as conn:
-            conn.execute('''
-                INSERT INTO edit_history (server_id, action, field_name, old_value, new_value, changed_by)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (server_id, action, field_name, old_value, new_value, st.session_state.user_email))
-            conn.commit()
+        HistoryManager.add_history_records([(server_id, action, field_name, old_value, new_value)])
 
     @staticmethod
-    def get_server_history(server_id: int = None) -> pd.DataFrame:
-        """編集履歴の取得"""
-        with get_db_connection() as conn:
-            query = '''
-                SELECT
-                    eh.id,
-                    eh.server_id,
-                    s.model as server_model,
-                    eh.action,
-                    eh.field_name,
-                    eh.old_value,
-                    eh.new_value,
-                    u.name as changed_by_name,
-                    eh.changed_by,
-                    eh.changed_at
-                FROM edit_history eh
-                LEFT JOIN servers s ON eh.server_id = s.id
-                LEFT JOIN users u ON eh.changed_by = u.email
-            '''
+    def add_history_records(records: list[tuple]):
+        """編集履歴の一括追加（1トランザクション）
 
-            params = []
-            if server_id:
-                query += ' WHERE eh.server_id = ?'
-                params.append(server_id)
+        records: (server_id, action, field_name, old_value, new_value) のリスト
+        """
+        if not records:
+            return
+        HistoryRepository.current().add(records, AuthManager.get_current_email())
 
-            query += ' ORDER BY eh.changed_at DESC'
+    @staticmethod
+    def get_server_history(server_id: int = None) -> pd.DataFrame:
+        """編集履歴の取得"""
+        return HistoryRepository.current().select_frame(server_id)
 
-            df = pd.read_sql_query(query, conn, params=params)
-            return df
+    @staticmethod
+    def iter_server_history(chunksize: int, server_id: int = None) -> Iterator[pd.DataFrame]:
+        """編集履歴をチャンク単位で取得"""
+        yield from HistoryRepository.current().iter_frames(chunksize, server_id)
 
     @staticmethod
     def record_server_creation(server_id: int, model: str):
@@ -64,13 +49,23 @@ class HistoryManager:
     @staticmethod
     def record_server_update(server_id: int, old_data: Dict[str, Any], new_data: Dict[str, Any]):
         """サーバ更新履歴の記録"""
+        HistoryManager.add_history_records(
+            HistoryManager.build_update_records(server_id, old_data, new_data)
+        )
+
+    @staticmethod
+    def build_update_records(server_id: int, old_data: Dict[str, Any],
+                             new_data: Dict[str, Any]) -> list[tuple]:
+        """更新された項目ごとの履歴レコードを作成（未設定と空文字は同一視）"""
+        records = []
         for field, label in FIELD_MAPPING.items():
-            if old_data.get(field) != new_data.get(field):
-                HistoryManager.add_history_record(
-                    server_id, 'UPDATE', label,
-                    str(old_data.get(field, '')),
-                    str(new_data.get(field, ''))
-                )
+            if field not in new_data:
+                continue
+            old_value = str(old_data.get(field) or '')
+            new_value = str(new_data.get(field) or '')
+            if old_value != new_value:
+                records.append((server_id, 'UPDATE', label, old_value, new_value))
+        return records
 
     @staticmethod
     def record_server_deletion(server_id: int, model: str):
@@ -0,0 +1,307 @@
+"""
+バックグラウンドジョブ管理モジュール
+
+ジョブの結果は JOB_RESULT_DIR のファイルに書き出して jobs.result_path に記録するため、
+どのプロセスからでも取得できる。結果ファイルは JOB_RESULT_TTL_HOURS を過ぎると削除する。
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable
+
+import pandas as pd
+
+from config import (
+    JOB_MAX_WORKERS, JOB_CHUNK_SIZE, JOB_HEARTBEAT_SECONDS, JOB_RESULT_DIR, JOB_RESULT_TTL_HOURS
+)
+from db_core import get_db_connection, read_frame, JOB_OWNER
+from server_service import ServerService
+
+
+class JobCancelled(Exception):
+    """ジョブがキャンセルされたことを示す例外"""
+
+
+class JobContext:
+    """実行中のジョブに渡す進捗報告・キャンセル確認用オブジェクト"""
+
+    def __init__(self, job_id: int, cancel_event: threading.Event):
+        self.job_id = job_id
+        self._cancel_event = cancel_event
+        self.result_path: Optional[str] = None
+
+    def is_cancelled(self) -> bool:
+        """キャンセル要求の有無"""
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """キャンセル要求があれば JobCancelled を送出"""
+        if self.is_cancelled():
+            raise JobCancelled()
+
+    def open_result(self, extension: str):
+        """結果ファイルを書き込み用に開く（大きな結果はメモリに保持せず直接書き出す）"""
+        os.makedirs(JOB_RESULT_DIR, exist_ok=True)
+        self.result_path = os.path.join(JOB_RESULT_DIR, f"job_{self.job_id}{extension}")
+        return open(self.result_path, 'w', encoding='utf-8', newline='')
+
+    def report_progress(self, progress: float, message: str = None):
+        """進捗（0.0〜1.0）の報告（他のプロセスからの中止要求もここで受け取る）"""
+        self.check_cancelled()
+        with get_db_connection() as conn:
+            row = conn.execute(
+                'UPDATE jobs SET progress = ?, message = COALESCE(?, message) WHERE id = ? RETURNING cancel_requested',
+                (max(0.0, min(1.0, progress)), message, self.job_id)
+            ).fetchone()
+            conn.commit()
+        if row is not None and row['cancel_requested']:
+            self._cancel_event.set()
+            raise JobCancelled()
+
+
+class JobManager:
+    """プロセス共通のバックグラウンドジョブを管理するクラス"""
+
+    STATUS_PENDING = 'PENDING'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_DONE = 'DONE'
+    STATUS_FAILED = 'FAILED'
+    STATUS_CANCELLED = 'CANCELLED'
+    FINISHED_STATUSES = ('DONE', 'FAILED', 'CANCELLED', 'INTERRUPTED')
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _heartbeat_thread: Optional[threading.Thread] = None
+    _lock = threading.Lock()
+    _cancel_events: Dict[int, threading.Event] = {}
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        """スレッドプールの取得（初回のみ生成し、生存確認のスレッドも起動）"""
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=JOB_MAX_WORKERS, thread_name_prefix="job"
+                )
+                cls._heartbeat_thread = threading.Thread(
+                    target=cls._heartbeat_loop, name="job-heartbeat", daemon=True
+                )
+                cls._heartbeat_thread.start()
+            return cls._executor
+
+    @staticmethod
+    def _heartbeat_loop():
+        """このプロセスのジョブの生存確認の時刻を定期的に更新（他プロセスの起動時に中断扱いにされないため）
+
+        あわせて他のプロセスからの中止要求を反映し、保持期間を過ぎた結果ファイルを削除する。
+        """
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                with get_db_connection() as conn:
+                    cancelled = conn.execute(
+                        "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status IN ('PENDING', 'RUNNING') "
+                        "RETURNING id, cancel_requested",
+                        (time.time(), JOB_OWNER)
+                    ).fetchall()
+                    conn.commit()
+                with JobManager._lock:
+                    for row in cancelled:
+                        if row['cancel_requested'] and row['id'] in JobManager._cancel_events:
+                            JobManager._cancel_events[row['id']].set()
+                JobManager.purge_results()
+            except Exception as e:
+                print(f"Error updating job heartbeat: {e}")
+
+    @classmethod
+    def submit(cls, kind: str, func: Callable[..., Any], *args,
+               created_by: str = None, slot: str = None, **kwargs) -> Optional[int]:
+        """ジョブの登録と実行開始
+
+        func は先頭引数に JobContext を受け取り、戻り値が結果として保持される。
+        slot を指定した場合は種別と slot の組ごとに1件だけ登録し、他のプロセスが登録済みなら None を返す。
+        """
+        with get_db_connection() as conn:
+            row = conn.execute('''
+                INSERT INTO jobs (kind, status, created_by, owner, heartbeat, slot) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, slot) DO NOTHING
+                RETURNING id
+            ''', (kind, cls.STATUS_PENDING, created_by, JOB_OWNER, time.time(), slot)).fetchone()
+            conn.commit()
+        if row is None:
+            return None
+        job_id = row['id']
+
+        cancel_event = threading.Event()
+        with cls._lock:
+            cls._cancel_events[job_id] = cancel_event
+
+        cls._get_executor().submit(cls._run, job_id, cancel_event, func, args, kwargs)
+        return job_id
+
+    @classmethod
+    def _run(cls, job_id: int, cancel_event: threading.Event,
+             func: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]):
+        """ワーカースレッドでのジョブ実行"""
+        context = JobContext(job_id, cancel_event)
+        try:
+            if cancel_event.is_set():
+                raise JobCancelled()
+            cls._set_status(job_id, cls.STATUS_RUNNING, started=True)
+            context.report_progress(0.0)
+            result = func(context, *args, **kwargs)
+            context.check_cancelled()
+            if context.result_path is None and result is not None:
+                with context.open_result('.json') as f:
+                    json.dump(result, f, ensure_ascii=False, default=str)
+            cls._set_status(job_id, cls.STATUS_DONE, progress=1.0, finished=True,
+                            result_path=context.result_path)
+        except JobCancelled:
+            cls._remove_file(context.result_path)
+            cls._set_status(job_id, cls.STATUS_CANCELLED, finished=True)
+        except Exception as e:
+            print(f"Error running job {job_id}: {e}")
+            cls._remove_file(context.result_path)
+            cls._set_status(job_id, cls.STATUS_FAILED, error=str(e), finished=True)
+        finally:
+            with cls._lock:
+                cls._cancel_events.pop(job_id, None)
+
+    @staticmethod
+    def _set_status(job_id: int, status: str, progress: float = None, error: str = None,
+                    started: bool = False, finished: bool = False, result_path: str = None):
+        """ジョブ状態の更新"""
+        with get_db_connection() as conn:
+            conn.execute(f'''
+                UPDATE jobs SET
+                    status = ?,
+                    progress = COALESCE(?, progress),
+                    error = ?,
+                    result_path = COALESCE(?, result_path)
+                    {', started_at = CURRENT_TIMESTAMP' if started else ''}
+                    {', finished_at = CURRENT_TIMESTAMP' if finished else ''}
+                WHERE id = ?
+            ''', (status, progress, error, result_path, job_id))
+            conn.commit()
+
+    @classmethod
+    def cancel(cls, job_id: int) -> bool:
+        """ジョブの中止要求（終了済みのジョブは False）
+
+        要求は jobs.cancel_requested に記録するため、他のプロセスが実行中のジョブも
+        次の進捗報告か生存確認の時点で停止する。
+        """
+        with get_db_connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN ('PENDING', 'RUNNING')",
+                (job_id,)
+            )
+            conn.commit()
+            requested = cursor.rowcount > 0
+        with cls._lock:
+            cancel_event = cls._cancel_events.get(job_id)
+        if requested and cancel_event is not None:
+            cancel_event.set()
+        return requested
+
+    @staticmethod
+    def get_job(job_id: int) -> Optional[Dict[str, Any]]:
+        """ジョブ情報の取得"""
+        with get_db_connection() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_jobs(created_by: str = None, limit: int = 20) -> pd.DataFrame:
+        """ジョブ一覧の取得（新しい順）"""
+        query = 'SELECT * FROM jobs'
+        params = []
+        if created_by:
+            query += ' WHERE created_by = ?'
+            params.append(created_by)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+
+        return read_frame(query, params)
+
+    @staticmethod
+    def get_result(job_id: int) -> Optional[Any]:
+        """完了済みジョブの結果を取得（CSV は文字列、それ以外は辞書。削除済みの場合は None）"""
+        job = JobManager.get_job(job_id)
+        path = job and job['result_path']
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8', newline='') as f:
+            return json.load(f) if path.endswith('.json') else f.read()
+
+    @staticmethod
+    def read_result_bytes(path: str) -> bytes:
+        """結果ファイルの内容（ダウンロードボタンでクリック時に読み込む）"""
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def discard_result(job_id: int):
+        """結果ファイルの削除"""
+        with get_db_connection() as conn:
+            row = conn.execute('SELECT result_path FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None or not row['result_path']:
+                return
+            JobManager._remove_file(row['result_path'])
+            conn.execute('UPDATE jobs SET result_path = NULL WHERE id = ?', (job_id,))
+            conn.commit()
+
+    @staticmethod
+    def purge_results() -> int:
+        """保持期間（JOB_RESULT_TTL_HOURS）を過ぎた結果ファイルの削除（削除したジョブ数を返す）"""
+        expires = time.time() - JOB_RESULT_TTL_HOURS * 3600
+        with get_db_connection() as conn:
+            rows = conn.execute('SELECT id, result_path FROM jobs WHERE result_path IS NOT NULL').fetchall()
+        expired = [
+            row['id'] for row in rows
+            if not os.path.exists(row['result_path']) or os.path.getmtime(row['result_path']) < expires
+        ]
+        for job_id in expired:
+            JobManager.discard_result(job_id)
+        return len(expired)
+
+    @staticmethod
+    def _remove_file(path: Optional[str]):
+        """ファイルの削除（存在しない場合は何もしない）"""
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def _export_csv(context: JobContext, total: int, chunks) -> int:
+    """チャンク列を結果ファイルに CSV で書き出しながら進捗を報告（書き出した行数を返す）"""
+    written = 0
+    with context.open_result('.csv') as f:
+        for chunk in chunks:
+            context.check_cancelled()
+            chunk.to_csv(f, index=False, header=written == 0)
+            written += len(chunk)
+            context.report_progress(written / total if total else 1.0, f"{written}/{total} 行")
+
+    return written
+
+
+def export_servers_job(context: JobContext) -> int:
+    """サーバデータの CSV エクスポート"""
+    service = ServerService()
+    total = service.get_statistics()['servers']
+    return _export_csv(context, total, service.iter_search_results('', JOB_CHUNK_SIZE))
+
+
+def export_history_job(context: JobContext) -> int:
+    """履歴データの CSV エクスポート"""
+    service = ServerService()
+    total = service.get_statistics()['history']
+    return _export_csv(context, total, service.iter_server_history(JOB_CHUNK_SIZE))
+
+
+def warranty_job(context: JobContext) -> Dict[str, Any]:
+    """保守期限による保守契約状態の一括判定"""
+    context.report_progress(0.0, "保守契約状態を判定中")
+    updated = ServerService().refresh_warranty_status()
+    return {'updated': updated, 'summary': f"保守契約状態を {updated:,} 台更新しました。"}
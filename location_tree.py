@@ -0,0 +1,108 @@
+"""
+設置場所の階層モジュール
+
+location（例: 「東京DC/B棟/3F/R12/U10」「東京DC / B棟 / R12」）を区切り（/ ／）で分解し、
+サイト → 建屋 → 部屋 → ラック → U の階層として扱う。
+servers.location_path に正規化したパス（小文字・「/」区切り・末尾「/」。例: 「東京dc/b棟/3f/r12/u10/」）を
+保持し（マテリアライズドパス）、配下のサーバの絞り込みはインデックスの範囲検索、
+ノードごとの台数はパスごとの件数（インデックスのみの集計）を上位のノードへ積み上げて求める。
+
+パスの先頭の要素はサイト別シャードのサイト名（shard_router.site_of）と一致する。
+
+pandas に依存しない（スキーマ初期化から呼び出すため）。
+"""
+import re
+from typing import NamedTuple, Optional, Iterable
+
+# 階層の区切り（「東京DC/B棟」「東京DC／B棟」「東京DC / B棟」を同じ階層とみなす。
+# 空白は区切りとせず、「Tokyo DC 1」のような空白を含む名前を1つの要素として扱う）
+SEPARATOR = re.compile(r'[/／]+')
+
+# 階層: (名前, 表示名, 判定パターン)
+LEVELS = [
+    ('site', 'サイト', None),
+    ('building', '建屋', re.compile(r'棟$|館$|BLDG|BUILDING', re.IGNORECASE)),
+    ('room', '部屋', re.compile(r'^\d+F$|^F\d+$|^\d+階$|室$|ROOM|ルーム|フロア', re.IGNORECASE)),
+    ('rack', 'ラック', re.compile(r'^(?:R|RACK|ラック)[-#]?\w+$', re.IGNORECASE)),
+    ('unit', 'U', re.compile(r'^U\d+(?:-\d+)?$|^\d+(?:-\d+)?U$', re.IGNORECASE)),
+]
+LEVEL_LABELS = {name: label for name, label, _ in LEVELS}
+
+
+class LocationNode(NamedTuple):
+    """階層の1ノード（台数は配下を含む）"""
+    path: str
+    name: str
+    level: str
+    depth: int
+    count: int
+
+
+class LocationTree:
+    """設置場所の分解・パスの正規化・ノードごとの台数の集計を行うクラス"""
+
+    @staticmethod
+    def segments(location: Optional[str]) -> list[str]:
+        """設置場所を階層の要素に分解（前後の空白を除き、表記はそのまま）"""
+        return [segment for segment in (part.strip() for part in SEPARATOR.split(location or '')) if segment]
+
+    @staticmethod
+    def path(location: Optional[str]) -> str:
+        """正規化したパス（設置場所が空の場合は空文字）"""
+        return ''.join(f'{segment.lower()}/' for segment in LocationTree.segments(location))
+
+    @staticmethod
+    def subtree_range(path: str) -> tuple[str, str]:
+        """パス配下（自身を含む）の範囲 [lower, upper)（「/」の次の文字は「0」）"""
+        return path, path[:-1] + '0'
+
+    @staticmethod
+    def levels(segments: list[str]) -> list[str]:
+        """要素ごとの階層を判定
+
+        先頭はサイト、以降は表記（「B棟」「3F」「R12」「U10」など）から判定し、
+        判定できない・上位と矛盾する要素は1つ上の要素の次の階層とする。
+        """
+        levels = []
+        previous = -1
+        for i, segment in enumerate(segments):
+            index = 0 if i == 0 else next(
+                (j for j, (_, _, pattern) in enumerate(LEVELS) if pattern and pattern.search(segment)), None
+            )
+            if index is None or index <= previous:
+                index = min(previous + 1, len(LEVELS) - 1)
+            levels.append(LEVELS[index][0])
+            previous = index
+        return levels
+
+    @staticmethod
+    def build(path_counts: Iterable[tuple[str, str, int]]) -> list[LocationNode]:
+        """(パス, 設置場所の表記の例, 台数) から配下を含めた台数のノード一覧を作る（パス順 = 親が先）"""
+        nodes: dict[str, list] = {}
+        for path, location, count in path_counts:
+            segments = LocationTree.segments(location)
+            levels = LocationTree.levels(segments)
+            prefix = ''
+            for depth, (segment, level) in enumerate(zip(segments, levels)):
+                prefix += f'{segment.lower()}/'
+                node = nodes.setdefault(prefix, [segment, level, depth, 0])
+                node[3] += count
+        return [LocationNode(path, *nodes[path]) for path in sorted(nodes)]
+
+    @staticmethod
+    def backfill(conn) -> int:
+        """location_path が未設定か現在の規則と異なるサーバのパスを設定（設定したサーバ数を返す）
+
+        空白も区切りとしていた以前の規則のパスは、空白を含む設置場所でのみ異なるため、それらだけを確認する。
+        """
+        candidates = conn.execute('''
+            SELECT id, location, location_path FROM servers
+            WHERE location_path IS NULL OR location LIKE ? OR location LIKE ? OR location LIKE ?
+        ''', ('% %', '%\u3000%', '%\t%')).fetchall()
+        pending = [
+            (path, server_id) for server_id, location, current in candidates
+            if (path := LocationTree.path(location)) != current
+        ]
+        if pending:
+            conn.executemany('UPDATE servers SET location_path = ? WHERE id = ?', pending)
+        return len(pending)
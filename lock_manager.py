@@ -4,7 +4,7 @@
 from typing import Optional, Dict, Any
 from datetime import datetime
 
-from database import get_db_connection
+from repositories import LockRepository
 
 
 class OptimisticLockManager:
@@ -13,13 +13,7 @@ class OptimisticLockManager:
     @staticmethod
     def get_server_version(server_id: int) -> Optional[int]:
         """サーバの現在のバージョンを取得"""
-        with get_db_connection() as conn:
-            result = conn.execute(
-                'SELECT version FROM servers WHERE id = ?',
-                (server_id,)
-            ).fetchone()
-
-            return result['version'] if result else None
+        return LockRepository.current().version(server_id)
 
     @staticmethod
     def check_version_conflict(server_id: int, expected_version: int) -> bool:
@@ -30,19 +24,12 @@ class OptimisticLockManager:
     @staticmethod
     def get_conflict_info(server_id: int) -> Optional[Dict[str, Any]]:
         """競合情報の取得"""
-        with get_db_connection() as conn:
-            result = conn.execute('''
-                SELECT s.updated_by, s.updated_at, u.name, s.version
-                FROM servers s
-                LEFT JOIN users u ON s.updated_by = u.email
-                WHERE s.id = ?
-            ''', (server_id,)).fetchone()
-
-            if result:
-                return {
-                    'updated_by': result['updated_by'],
-                    'updated_at': result['updated_at'],
-                    'user_name': result['name'] or result['updated_by'],
-                    'version': result['version']
-                }
-                return None
+        result = LockRepository.current().last_update(server_id)
+        if result:
+            return {
+                'updated_by': result['updated_by'],
+                'updated_at': result['updated_at'],
+                'user_name': result['name'] or result['updated_by'],
+                'version': result['version']
+            }
+        return None
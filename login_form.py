@@ -0,0 +1,46 @@
+"""
+ログインフォーム
+
+起動直後に表示されるため、pandas などの重いモジュールを読み込まない。
+"""
+import streamlit as st
+
+from auth import AuthManager
+
+
+class LoginForm:
+    """ログインフォームクラス"""
+
+    @staticmethod
+    def render():
+        """ログインフォームの表示"""
+        st.title("🖥️ サーバ在庫管理システム")
+        st.markdown("---")
+
+        col1, col2, col3 = st.columns([1, 2, 1])
+
+        with col2:
+            st.markdown("### Googleアカウントでログイン")
+            st.markdown("このシステムを利用するには、Googleアカウントでのログインが必要です。")
+
+            # 簡易的なGoogle認証フォーム（実際の実装では適切なOAuth2フローを使用）
+            with st.form("login_form"):
+                st.markdown("**開発用ログイン**")
+                email = st.text_input("メールアドレス", placeholder="user@example.com")
+                name = st.text_input("表示名", placeholder="山田太郎")
+
+                if st.form_submit_button("ログイン", use_container_width=True):
+                    if email and name:
+                        # 開発用の簡易ログイン
+                        user_info = {
+                            'email': email,
+                            'name': name,
+                            'picture': ''
+                        }
+                        AuthManager.login_user(user_info)
+                        st.rerun()
+                    else:
+                        st.error("メールアドレスと表示名を入力してください。")
+
+            st.markdown("---")
+            st.markdown("💡 **本番環境では**、適切なGoogle OAuth2認証を実装してください。")
@@ -1,13 +1,17 @@
 """
 メインアプリケーション
 """
+import time
+
+# 再実行ごとの描画時間を計測するため、最初に開始時刻を取得する
+_run_started = time.perf_counter()
+
 import streamlit as st
 
 from config import PAGE_CONFIG
-from database import init_database
+from db_core import init_database
 from auth import AuthManager
-from ui_components import UIComponents
-from pages import PageRenderer
+from startup_metrics import StartupMetrics
 
 
 def main():
@@ -15,14 +19,21 @@ def main():
     # ページ設定
     st.set_page_config(**PAGE_CONFIG)
 
-    # データベース初期化
+    # データベース初期化（プロセスごとに1回）
     init_database()
 
-    # 認証チェック
+    # 認証チェック（ログイン画面は pandas 等を読み込まずに表示する）
     if not AuthManager.is_authenticated():
-        UIComponents.render_login_form()
+        from login_form import LoginForm
+        LoginForm.render()
+        StartupMetrics.record_first("login_page", time.perf_counter() - _run_started)
+        _start_background_services()
         return
 
+    # 重いモジュールはログイン後の初回描画時に読み込む
+    from pages import PageRenderer
+    from ui_components import UIComponents
+
     # ページレンダラー初期化
     page_renderer = PageRenderer()
     ui_components = UIComponents()
@@ -33,6 +44,7 @@ def main():
     # ページ表示
     if page == "サーバ一覧":
         page_renderer.render_server_list()
+        StartupMetrics.record_first("server_list", time.perf_counter() - _run_started)
     elif page == "サーバ追加":
         page_renderer.render_server_form()
     elif page == "編集履歴":
@@ -40,6 +52,14 @@ def main():
     elif page == "データ管理":
         page_renderer.render_data_management()
 
+    _start_background_services()
+
+
+def _start_background_services():
+    """描画後にバックグラウンド処理を起動（プロセスごとに1回）"""
+    from maintenance import MaintenanceManager
+    MaintenanceManager.start_scheduler()
+
 
 if __name__ == "__main__":
     main()
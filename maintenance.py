@@ -0,0 +1,387 @@
+"""
+データベースメンテナンスモジュール
+
+オンラインバックアップ・整合性チェック・統計更新・VACUUM を提供する。
+コマンドラインからも実行できる:
+
+    python maintenance.py backup     # バックアップとローテーション
+    python maintenance.py check      # PRAGMA quick_check
+    python maintenance.py optimize   # ANALYZE と PRAGMA optimize
+    python maintenance.py vacuum     # VACUUM
+    python maintenance.py all        # backup + check + optimize（定期メンテナンスと同じ）
+
+サイト別シャード（SHARD_DIR）が有効な場合は、既定のデータベース・カタログ・全シャードを対象とし、
+バックアップはそれらをまとめた1つのディレクトリとして作成する。
+"""
+import argparse
+import glob
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, Callable
+
+import streamlit as st
+
+from config import (
+    BACKUP_DIR, BACKUP_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP,
+    MAINTENANCE_INTERVAL_HOURS, MAINTENANCE_POLL_SECONDS, WARRANTY_REFRESH_INTERVAL_HOURS
+)
+from db_core import get_db_connection
+from job_manager import JobManager, JobContext, warranty_job
+from shard_router import ShardRouter
+from storage import SQLiteBackend, get_default_backend
+
+
+def _format_bytes(size: int) -> str:
+    """バイト数の表示用文字列"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024 or unit == 'GB':
+            return f"{size:,.0f} {unit}" if unit == 'B' else f"{size:,.1f} {unit}"
+        size /= 1024
+
+
+def _sqlite_path() -> str:
+    """既定の SQLite ファイルパス（PostgreSQL では pg_dump・VACUUM ANALYZE 等を使う）"""
+    backend = get_default_backend()
+    if backend.name != 'sqlite':
+        raise RuntimeError("メンテナンス機能は SQLite バックエンドでのみ利用できます。")
+    return backend.path
+
+
+def _sqlite_targets() -> list[SQLiteBackend]:
+    """メンテナンス対象のデータベース（シャード有効時は既定のデータベース・カタログ・全シャード）"""
+    _sqlite_path()
+    router = ShardRouter.get()
+    if not router.enabled:
+        return [get_default_backend()]
+    return [get_default_backend(), SQLiteBackend(router.catalog_path)] + router.backends()
+
+
+def _label(backend: SQLiteBackend) -> str:
+    """レポート用のデータベース名（ファイル名）"""
+    return os.path.basename(backend.path)
+
+
+def _backup_file(source_path: str, target_path: str, on_step: Callable):
+    """1つのデータベースのオンラインバックアップ（整合性チェックに失敗した場合は例外）"""
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    try:
+        # WAL モードでは読み取りトランザクションでスナップショットを固定しておけば、
+        # 他の接続が書き込んでもバックアップが最初からやり直しにならない
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=on_step)
+        source.execute('COMMIT')
+        integrity = target.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+    if integrity != 'ok':
+        raise RuntimeError(f"バックアップの整合性チェックに失敗しました: {os.path.basename(source_path)}: {integrity}")
+
+
+def _count_servers(paths: list[str]) -> int:
+    """バックアップに含まれるサーバ数"""
+    total = 0
+    for path in paths:
+        conn = sqlite3.connect(path)
+        try:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'servers'").fetchone():
+                total += conn.execute('SELECT COUNT(*) FROM servers').fetchone()[0]
+        finally:
+            conn.close()
+    return total
+
+
+def _remove_path(path: str):
+    """バックアップ（ファイルまたはディレクトリ）の削除"""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class MaintenanceManager:
+    """データベースメンテナンスを管理するクラス
+
+    各操作は結果を辞書で返し、'elapsed'（秒）と表示用の 'summary' を必ず含む。
+    """
+
+    @staticmethod
+    def backup(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP,
+               progress: Callable[[float], None] = None) -> Dict[str, Any]:
+        """オンラインバックアップの作成とローテーション
+
+        sqlite3.Connection.backup でページ単位に少しずつ複製し、ステップ間で
+        ロックを解放するため、バックアップ中も他の接続から書き込める。
+        シャード有効時は全データベースを1つのディレクトリ（<名前>_<日時>/）に複製する。
+        """
+        started = time.monotonic()
+        targets = _sqlite_targets()
+        sharded = len(targets) > 1
+        os.makedirs(backup_dir, exist_ok=True)
+
+        base_name = os.path.splitext(os.path.basename(_sqlite_path()))[0]
+        stem = os.path.join(backup_dir, f"{base_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        extension = '' if sharded else '.db'
+        path = f"{stem}{extension}"
+        suffix = 1
+        while os.path.exists(path):
+            path = f"{stem}_{suffix}{extension}"
+            suffix += 1
+        tmp_path = path + '.tmp'
+
+        reported = [-1]
+        current = [0]
+
+        def on_step(status, remaining, total):
+            # 進捗の書き込みは1%刻みに間引く（シャード有効時はデータベース数で按分）
+            if progress and total:
+                done = (current[0] + (total - remaining) / total) / len(targets)
+                if int(done * 100) > reported[0]:
+                    reported[0] = int(done * 100)
+                    progress(done)
+            time.sleep(BACKUP_STEP_SLEEP)
+
+        if sharded:
+            os.makedirs(tmp_path)
+            files = [os.path.join(tmp_path, _label(backend)) for backend in targets]
+        else:
+            files = [tmp_path]
+        try:
+            for index, (backend, file_path) in enumerate(zip(targets, files)):
+                current[0] = index
+                _backup_file(backend.path, file_path, on_step)
+            # シャード有効時のサーバはシャードにだけ置かれる（既定のデータベースの servers は使われない）
+            servers = _count_servers(files[2:] if sharded else files)
+        except Exception:
+            _remove_path(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+
+        removed = MaintenanceManager.rotate_backups(backup_dir, keep)
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) if sharded \
+            else os.path.getsize(path)
+        elapsed = time.monotonic() - started
+        return {
+            'path': path,
+            'size': size,
+            'databases': len(targets),
+            'servers': servers,
+            'removed': removed,
+            'elapsed': elapsed,
+            'summary': (
+                f"{path} ({f'{len(targets)} データベース、' if sharded else ''}サーバ {servers:,} 台、"
+                f"{_format_bytes(size)}) を作成、"
+                f"古いバックアップ {len(removed)} 件を削除 [{elapsed:.1f}秒]"
+            ),
+        }
+
+    @staticmethod
+    def rotate_backups(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> list[str]:
+        """新しい順に keep 件を残して古いバックアップ（ファイルまたはシャードごとのディレクトリ）を削除"""
+        base_name = os.path.splitext(os.path.basename(_sqlite_path()))[0]
+        backups = sorted(
+            (path for path in glob.glob(os.path.join(backup_dir, f"{base_name}_*"))
+             if path.endswith('.db') or (os.path.isdir(path) and not path.endswith('.tmp'))),
+            reverse=True
+        )
+        removed = backups[keep:] if keep > 0 else []
+        for path in removed:
+            _remove_path(path)
+        return removed
+
+    @staticmethod
+    def quick_check() -> Dict[str, Any]:
+        """PRAGMA quick_check による整合性チェック"""
+        started = time.monotonic()
+        targets = _sqlite_targets()
+        messages = []
+        reclaimable = 0
+        for backend in targets:
+            with backend.connect() as conn:
+                result = [row[0] for row in conn.execute('PRAGMA quick_check').fetchall()]
+                page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+                freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if result != ['ok']:
+                messages.extend(f"{_label(backend)}: {message}" if len(targets) > 1 else message
+                                for message in result)
+            reclaimable += page_size * freelist
+
+        ok = not messages
+        messages = messages or ['ok']
+        elapsed = time.monotonic() - started
+        return {
+            'ok': ok,
+            'messages': messages,
+            'reclaimable': reclaimable,
+            'elapsed': elapsed,
+            'summary': (
+                f"整合性チェック: {'正常' if ok else '異常あり: ' + '; '.join(messages[:5])}、"
+                f"VACUUMで回収可能 {_format_bytes(reclaimable)} [{elapsed:.1f}秒]"
+            ),
+        }
+
+    @staticmethod
+    def optimize() -> Dict[str, Any]:
+        """ANALYZE と PRAGMA optimize による統計情報の更新"""
+        started = time.monotonic()
+        for backend in _sqlite_targets():
+            with backend.connect() as conn:
+                conn.execute('ANALYZE')
+                conn.execute('PRAGMA optimize')
+                conn.commit()
+        elapsed = time.monotonic() - started
+        return {'elapsed': elapsed, 'summary': f"ANALYZE・PRAGMA optimize 完了 [{elapsed:.1f}秒]"}
+
+    @staticmethod
+    def vacuum() -> Dict[str, Any]:
+        """VACUUM によるデータベースファイルの最適化（実行中は書き込みが待たされる）"""
+        started = time.monotonic()
+        size_before = size_after = 0
+        for backend in _sqlite_targets():
+            with backend.connect() as conn:
+                # WAL の内容を本体に反映してからサイズを比較する
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                size_before += os.path.getsize(backend.path)
+                conn.execute('VACUUM')
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                size_after += os.path.getsize(backend.path)
+
+        reclaimed = size_before - size_after
+        elapsed = time.monotonic() - started
+        return {
+            'size_before': size_before,
+            'size_after': size_after,
+            'reclaimed': reclaimed,
+            'elapsed': elapsed,
+            'summary': f"VACUUM 完了: {_format_bytes(reclaimed)} 削減 [{elapsed:.1f}秒]",
+        }
+
+    @staticmethod
+    def run_all(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP,
+                progress: Callable[[float, str], None] = None) -> Dict[str, Any]:
+        """定期メンテナンス（バックアップ → 整合性チェック → 最適化）"""
+        report = progress or (lambda value, message: None)
+        started = time.monotonic()
+
+        report(0.0, "バックアップ中")
+        backup = MaintenanceManager.backup(
+            backup_dir, keep, progress=lambda value: report(value * 0.8, "バックアップ中")
+        )
+        report(0.8, "整合性チェック中")
+        check = MaintenanceManager.quick_check()
+        report(0.9, "最適化中")
+        optimize = MaintenanceManager.optimize()
+
+        elapsed = time.monotonic() - started
+        return {
+            'backup': backup,
+            'check': check,
+            'optimize': optimize,
+            'elapsed': elapsed,
+            'summary': '\n'.join([backup['summary'], check['summary'], optimize['summary']]),
+        }
+
+    @staticmethod
+    def get_last_run(kind: str = 'maintenance') -> Optional[Dict[str, Any]]:
+        """最後に成功した定期ジョブ（既定は定期メンテナンス）の取得"""
+        with get_db_connection() as conn:
+            row = conn.execute('''
+                SELECT * FROM jobs
+                WHERE kind = ? AND status = 'DONE'
+                ORDER BY finished_at DESC LIMIT 1
+            ''', (kind,)).fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def _submit_if_due(kind: str, func: Callable[[JobContext], Any], interval: timedelta) -> Optional[int]:
+        """interval ごとの枠で1回、実行中でなければ定期ジョブを登録
+
+        枠は UNIX 時間を interval で区切ったもので、開始時刻（UTC）を jobs.slot に記録する。
+        種別と枠の一意キーで登録するため、複数のプロセスが同時に判定しても登録されるのは1件だけになる
+        （失敗した場合も次の枠まで再実行しない）。
+        """
+        seconds = interval.total_seconds()
+        start = datetime.fromtimestamp(time.time() // seconds * seconds, timezone.utc)
+        with get_db_connection() as conn:
+            running = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE kind = ? AND status IN ('PENDING', 'RUNNING')", (kind,)
+            ).fetchone()[0]
+        if running:
+            return None
+        return JobManager.submit(kind, func, slot=start.isoformat())
+
+    @staticmethod
+    @st.cache_resource
+    def start_scheduler() -> Optional[threading.Thread]:
+        """定期ジョブ（メンテナンス・保守契約状態の判定）のスケジューラ起動（プロセスごとに1回）"""
+        schedules = []
+        if MAINTENANCE_INTERVAL_HOURS > 0 and get_default_backend().name == 'sqlite':
+            schedules.append(('maintenance', maintenance_job, timedelta(hours=MAINTENANCE_INTERVAL_HOURS)))
+        if WARRANTY_REFRESH_INTERVAL_HOURS > 0:
+            schedules.append(('warranty', warranty_job, timedelta(hours=WARRANTY_REFRESH_INTERVAL_HOURS)))
+        if not schedules:
+            return None
+
+        def loop():
+            while True:
+                for kind, func, interval in schedules:
+                    try:
+                        MaintenanceManager._submit_if_due(kind, func, interval)
+                    except Exception as e:
+                        print(f"Error scheduling {kind}: {e}")
+                time.sleep(MAINTENANCE_POLL_SECONDS)
+
+        thread = threading.Thread(target=loop, name="maintenance-scheduler", daemon=True)
+        thread.start()
+        return thread
+
+
+def backup_job(context: JobContext) -> Dict[str, Any]:
+    """バックアップジョブ"""
+    return MaintenanceManager.backup(progress=lambda value: context.report_progress(value, "バックアップ中"))
+
+
+def maintenance_job(context: JobContext) -> Dict[str, Any]:
+    """定期メンテナンスジョブ"""
+    return MaintenanceManager.run_all(progress=context.report_progress)
+
+
+def vacuum_job(context: JobContext) -> Dict[str, Any]:
+    """VACUUM ジョブ"""
+    context.report_progress(0.0, "VACUUM 実行中")
+    return MaintenanceManager.vacuum()
+
+
+def main(argv: list[str] = None) -> int:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="サーバ在庫データベースのメンテナンス")
+    parser.add_argument('command', choices=['backup', 'check', 'optimize', 'vacuum', 'all'])
+    parser.add_argument('--dir', default=BACKUP_DIR, help="バックアップ先ディレクトリ")
+    parser.add_argument('--keep', type=int, default=BACKUP_KEEP, help="保持するバックアップ数")
+    args = parser.parse_args(argv)
+
+    if args.command == 'backup':
+        result = MaintenanceManager.backup(args.dir, args.keep)
+    elif args.command == 'check':
+        result = MaintenanceManager.quick_check()
+    elif args.command == 'optimize':
+        result = MaintenanceManager.optimize()
+    elif args.command == 'vacuum':
+        result = MaintenanceManager.vacuum()
+    else:
+        result = MaintenanceManager.run_all(args.dir, args.keep)
+
+    print(result['summary'])
+    return 1 if result.get('ok') is False or result.get('check', {}).get('ok') is False else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
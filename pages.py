@@ -2,11 +2,14 @@
 ページ表示ロジック
 """
 import streamlit as st
-import pandas as pd
-from datetime import datetime
 
+from config import FIELD_MAPPING, JOB_POLL_SECONDS, WARRANTY_EXPIRING_DAYS
 from server_service import ServerService
-from history_manager import HistoryManager
+from filter_query import FilterSyntaxError
+from job_manager import JobManager, export_servers_job, export_history_job, warranty_job
+from maintenance import MaintenanceManager, backup_job, maintenance_job, vacuum_job
+from reconciliation import DiscoveryReconciler
+from startup_metrics import StartupMetrics
 from ui_components import UIComponents
 
 
@@ -15,30 +18,53 @@ class PageRenderer:
 
     def __init__(self):
         self.server_service = ServerService()
-        self.history_manager = HistoryManager()
         self.ui_components = UIComponents()
 
     def render_server_list(self):
         """サーバ一覧ページ"""
         st.title("📋 サーバ一覧")
 
-        # 検索機能
-        search_term = st.text_input("🔍 検索", placeholder="型番、設置場所、利用者名、IPアドレスなど")
-
-        # サーバデータ取得
-        df = self.server_service.get_all_servers()
-
-        if df.empty:
-            st.info("登録されているサーバはありません。")
+        # 検索機能（フィルタはURLのクエリパラメータ q と同期して共有可能にする）
+        search_term = st.text_input(
+            "🔍 検索",
+            value=st.query_params.get("q", ""),
+            placeholder="例: location:東京DC os:ubuntu* warranty:期限切れ purchased<2020-01-01 ip:10.0.0.0/8 -user:山田",
+            help="項目:値 で絞り込み（model, location, os, warranty, expires, user, gpu, notes, purchased, ip, host, mac, id）。"
+                 "値の末尾 * で前方一致、< > <= >= で範囲指定、先頭 - で除外、項目なしの語は全項目の部分一致。"
+                 "日付は今日からの日数でも指定でき、expires>=0d expires<=30d で30日以内に保守期限を迎えるサーバ。"
+                 "GPU 搭載数は gpus>=4（合計）、gpus:A100>=2（型番別）、設置場所の配下は under:東京DC/B棟 で指定。"
+        )
+        if search_term:
+            st.query_params["q"] = search_term
+        elif "q" in st.query_params:
+            del st.query_params["q"]
+
+        # ファセット・設置場所の階層の選択
+        facet_selections = self.ui_components.get_facet_selections()
+        location_node = self.ui_components.get_location_node()
+        query = f"{search_term} under:{location_node}" if location_node else search_term
+
+        # サーバデータ・ファセット件数・階層ごとの台数取得（フィルタはSQLで実行）
+        try:
+            df = self.server_service.search_servers(query, facet_selections)
+            facet_counts = self.server_service.get_facet_counts(query, facet_selections)
+            location_tree = self.server_service.get_location_tree(search_term, facet_selections)
+        except FilterSyntaxError as e:
+            st.error(f"検索条件が不正です: {e}")
             return
 
-        # 検索フィルタ
-        df = self.server_service.search_servers(df, search_term)
+        self.ui_components.render_location_tree(location_tree)
+        self.ui_components.render_facet_filters(facet_counts, facet_selections)
 
         if df.empty:
-            st.info("検索条件に一致するサーバが見つかりません。")
+            if query or any(facet_selections.values()):
+                st.info("検索条件に一致するサーバが見つかりません。")
+            else:
+                st.info("登録されているサーバはありません。")
             return
 
+        st.markdown(f"**{len(df)}台**")
+
         # サーバカード表示
         for _, server in df.iterrows():
             self.ui_components.render_server_card(server, self.server_service)
@@ -113,7 +139,7 @@ class PageRenderer:
         if selected_server != "全て":
             server_id = int(selected_server.split("ID: ")[1].split(")")[0])
 
-        history_df = self.history_manager.get_server_history(server_id)
+        history_df = self.server_service.get_server_history(server_id)
 
         if history_df.empty:
             st.info("履歴がありません。")
@@ -142,14 +168,180 @@ class PageRenderer:
             st.markdown("### 📤 エクスポート")
 
             if st.button("サーバデータをCSV出力", use_container_width=True):
-                df = self.server_service.get_all_servers()
-                self.ui_components.create_csv_download_button(df, "servers", "ダウンロード")
+                JobManager.submit("export_servers", export_servers_job,
+                                  created_by=st.session_state.user_email)
 
             if st.button("履歴データをCSV出力", use_container_width=True):
-                df = self.history_manager.get_server_history()
-                self.ui_components.create_csv_download_button(df, "history", "ダウンロード")
+                JobManager.submit("export_history", export_history_job,
+                                  created_by=st.session_state.user_email)
+
+            st.markdown("### 🧹 メンテナンス")
+
+            if st.button("バックアップ作成", use_container_width=True):
+                JobManager.submit("backup", backup_job,
+                                  created_by=st.session_state.user_email)
+
+            if st.button("整合性チェック・最適化", use_container_width=True):
+                JobManager.submit("maintenance", maintenance_job,
+                                  created_by=st.session_state.user_email)
+
+            if st.button("データベース最適化 (VACUUM)", use_container_width=True):
+                JobManager.submit("vacuum", vacuum_job,
+                                  created_by=st.session_state.user_email)
+
+            if st.button("保守契約状態を判定", use_container_width=True):
+                JobManager.submit("warranty", warranty_job,
+                                  created_by=st.session_state.user_email)
 
         with col2:
             st.markdown("### 📊 統計情報")
             stats = self.server_service.get_statistics()
             self.ui_components.render_statistics(stats)
+
+            gpu_totals = self.server_service.get_gpu_totals()
+            if not gpu_totals.empty:
+                st.markdown("#### 🎮 設置場所別 GPU 搭載数")
+                st.dataframe(
+                    gpu_totals.rename(columns={
+                        'location': '設置場所', 'model': '型番', 'servers': '台数',
+                        'gpus': 'GPU 数', 'memory_gb': 'GPU メモリ合計 (GB)'
+                    }),
+                    hide_index=True, use_container_width=True
+                )
+
+            last_run = MaintenanceManager.get_last_run()
+            st.caption(f"最終メンテナンス: {last_run['finished_at'] if last_run else '未実行'} (UTC)")
+            last_warranty_run = MaintenanceManager.get_last_run('warranty')
+            st.caption(
+                f"保守契約状態の最終判定: {last_warranty_run['finished_at'] if last_warranty_run else '未実行'} (UTC)"
+            )
+
+            startup = StartupMetrics.get_summary()
+            if startup:
+                labels = {"login_page": "ログイン画面", "server_list": "サーバ一覧"}
+                st.caption("起動後の初回描画時間（直近 / 平均）: " + "、".join(
+                    f"{labels.get(m['metric'], m['metric'])} {m['latest'] * 1000:.0f} / {m['average'] * 1000:.0f} ms"
+                    for m in startup
+                ))
+
+        self.render_expiring_warranties()
+        self.render_reconciliation()
+        self.render_jobs()
+
+    def render_jobs(self):
+        """ジョブ一覧（実行中のジョブがある間はこの部分だけを定期的に再描画）"""
+        st.markdown("### ⚙️ ジョブ")
+        statuses = JobManager.get_jobs(created_by=st.session_state.user_email)['status']
+        polling = not statuses.isin(JobManager.FINISHED_STATUSES).all()
+        st.fragment(self._render_job_list, run_every=JOB_POLL_SECONDS if polling else None)(polling)
+
+    def _render_job_list(self, polling: bool):
+        """ジョブ一覧の本体"""
+        jobs_df = JobManager.get_jobs(created_by=st.session_state.user_email)
+
+        if jobs_df.empty:
+            st.info("実行したジョブはありません。")
+            return
+
+        for _, job in jobs_df.iterrows():
+            self.ui_components.render_job(job)
+
+        # すべて完了したらページ全体を1回だけ再描画してポーリングを止める（最終実行日時なども更新）
+        if polling and jobs_df['status'].isin(JobManager.FINISHED_STATUSES).all():
+            st.rerun()
+
+    def render_expiring_warranties(self):
+        """保守期限が近いサーバの一覧"""
+        st.markdown("### ⏰ 保守期限が近いサーバ")
+        days = int(st.number_input(
+            "日数", min_value=1, max_value=3650, value=WARRANTY_EXPIRING_DAYS, step=30,
+            help="今日から指定した日数以内に保守期限を迎えるサーバを表示します"
+        ))
+        expiring = self.server_service.get_expiring_servers(days)
+        if expiring.empty:
+            st.info(f"{days}日以内に保守期限を迎えるサーバはありません。")
+            return
+
+        columns = ['warranty_end_date', 'id', 'model', 'location', 'user_name', 'warranty_status']
+        st.markdown(f"**{len(expiring)}台**（サーバ一覧では expires>=0d expires<={days}d で検索できます）")
+        st.dataframe(
+            expiring[columns].rename(columns={**FIELD_MAPPING, 'id': 'ID'}),
+            hide_index=True, use_container_width=True
+        )
+
+    def render_reconciliation(self):
+        """ディスカバリ結果との照合"""
+        st.markdown("### 🔄 ディスカバリ照合")
+        uploaded = st.file_uploader(
+            "スキャン結果（CSV / JSON / NDJSON、列: ip, hostname, os, mac）",
+            type=["csv", "json", "ndjson", "jsonl"]
+        )
+        if uploaded is None:
+            st.session_state.pop("reconciliation", None)
+            return
+
+        # 解析結果はファイルごと、照合結果はデータ世代ごとに保持して再実行時の再計算を避ける
+        cache = st.session_state.get("reconciliation")
+        if cache is None or cache["file_id"] != uploaded.file_id:
+            with st.spinner("スキャン結果を読み込み中..."):
+                scan_df = DiscoveryReconciler.parse_scan(uploaded, uploaded.name)
+            cache = {"file_id": uploaded.file_id, "scan": scan_df, "generation": None}
+            st.session_state.reconciliation = cache
+
+        generation = self.server_service.get_generation()
+        if cache["generation"] != generation:
+            cache["result"] = self.server_service.reconcile_discovery(cache["scan"])
+            cache["generation"] = generation
+        result = cache["result"]
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("未検出（台帳のみ）", len(result["missing"]))
+        with col2:
+            st.metric("未登録（スキャンのみ）", len(result["unknown"]))
+        with col3:
+            st.metric("OS・IP 変更", len(result["changed"]))
+
+        tab_changed, tab_missing, tab_unknown = st.tabs(["OS・IP 変更", "未検出", "未登録"])
+
+        with tab_changed:
+            if result["changed"].empty:
+                st.info("変更はありません。")
+            else:
+                # OS の違いは表記やスキャンの推定によるものが多いため、既定では IP の変更だけを選択する
+                st.caption("OS の変更は既定で選択されていません。確認してから「OS適用」を選択してください。")
+                changed = result["changed"]
+                edited = st.data_editor(
+                    changed.assign(apply_ip=changed["new_ip_address"] != "", apply_os=False),
+                    column_config={
+                        "apply_ip": st.column_config.CheckboxColumn("IP適用"),
+                        "apply_os": st.column_config.CheckboxColumn("OS適用"),
+                        "version": None,
+                        "model": "型番", "location": "設置場所", "matched_by": "照合キー",
+                        "ip_address": "IPアドレス", "new_ip_address": "新IPアドレス",
+                        "os": "OS", "new_os": "新OS",
+                    },
+                    disabled=[c for c in changed.columns],
+                    hide_index=True,
+                    use_container_width=True,
+                    key=f"reconcile_editor_{cache['generation']}"
+                )
+                selected = edited[
+                    (edited["apply_ip"] & (edited["new_ip_address"] != ""))
+                    | (edited["apply_os"] & (edited["new_os"] != ""))
+                ]
+                if st.button(f"選択した {len(selected)} 件の差分を適用", disabled=selected.empty):
+                    applied, conflicts = self.server_service.apply_reconciliation(selected)
+                    st.success(f"{applied}件を更新しました。")
+                    if conflicts:
+                        st.warning(f"{conflicts}件は他のユーザーが先に更新したため適用しませんでした。")
+
+        with tab_missing:
+            st.dataframe(result["missing"], hide_index=True, use_container_width=True)
+            if not result["missing"].empty:
+                self.ui_components.create_csv_download_button(result["missing"], "missing", "CSV出力")
+
+        with tab_unknown:
+            st.dataframe(result["unknown"], hide_index=True, use_container_width=True)
+            if not result["unknown"].empty:
+                self.ui_components.create_csv_download_button(result["unknown"], "unknown", "CSV出力")
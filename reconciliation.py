@@ -0,0 +1,257 @@
+"""
+ディスカバリ結果との照合モジュール
+
+nmap や DHCP リースなどから出力したホスト一覧（CSV / JSON / NDJSON）を
+servers テーブルと突き合わせ、未検出・未登録・OS/IP 変更を抽出する。
+OS は表記の揺れ（「Ubuntu 22.04.3 LTS」と「ubuntu 22.04」など）を除くため、種類と主バージョンで比較する。
+"""
+import io
+import json
+from itertools import islice
+from typing import Dict, Any, BinaryIO, Iterator, TextIO
+
+import pandas as pd
+
+SCAN_CHUNK_SIZE = 50000
+# JSON ファイルを読み込む単位（文字数）
+JSON_READ_SIZE = 1 << 20
+
+# スキャン結果の列名 -> 正規化後の列名
+SCAN_COLUMN_ALIASES = {
+    'ip': 'ip_address', 'ip_address': 'ip_address', 'ipaddr': 'ip_address',
+    'ipv4': 'ip_address', 'address': 'ip_address', 'addr': 'ip_address',
+    'hostname': 'hostname', 'host': 'hostname', 'name': 'hostname',
+    'fqdn': 'hostname', 'client_hostname': 'hostname',
+    'os': 'os', 'os_name': 'os', 'osname': 'os', 'os_family': 'os', 'osfamily': 'os',
+    'mac': 'mac_address', 'mac_address': 'mac_address', 'macaddr': 'mac_address',
+    'hwaddr': 'mac_address', 'hardware_ethernet': 'mac_address',
+}
+SCAN_COLUMNS = ['ip_address', 'hostname', 'mac_address', 'os']
+
+# 照合キー（優先順）
+MATCH_KEYS = [('key_mac', 'MAC'), ('key_host', 'ホスト名'), ('key_ip', 'IP')]
+
+
+class DiscoveryReconciler:
+    """ディスカバリ結果とサーバ台帳の照合を行うクラス"""
+
+    @staticmethod
+    def parse_scan(file: BinaryIO, filename: str) -> pd.DataFrame:
+        """スキャン結果ファイルをチャンク単位で読み込み、正規化した DataFrame を返す"""
+        name = filename.lower()
+        if name.endswith(('.ndjson', '.jsonl')):
+            chunks = pd.read_json(file, lines=True, dtype=False, chunksize=SCAN_CHUNK_SIZE)
+        elif name.endswith('.json'):
+            records = _iter_json_records(io.TextIOWrapper(file, encoding='utf-8-sig'))
+            chunks = (
+                pd.DataFrame(batch)
+                for batch in iter(lambda: list(islice(records, SCAN_CHUNK_SIZE)), [])
+            )
+        else:
+            header = pd.read_csv(file, nrows=0, encoding='utf-8-sig')
+            usecols = [c for c in header.columns if str(c).strip().lower() in SCAN_COLUMN_ALIASES]
+            file.seek(0)
+            chunks = pd.read_csv(file, usecols=usecols, dtype=str, encoding='utf-8-sig',
+                                 chunksize=SCAN_CHUNK_SIZE, keep_default_na=False)
+
+        frames = [DiscoveryReconciler._normalize_columns(chunk) for chunk in chunks]
+        if not frames:
+            return pd.DataFrame(columns=SCAN_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def _normalize_columns(chunk: pd.DataFrame) -> pd.DataFrame:
+        """列名をエイリアスから正規化し、必要な列のみ残す"""
+        renamed = {}
+        for column in chunk.columns:
+            target = SCAN_COLUMN_ALIASES.get(str(column).strip().lower())
+            if target and target not in renamed.values():
+                renamed[column] = target
+        chunk = chunk[list(renamed)].rename(columns=renamed)
+        for column in SCAN_COLUMNS:
+            if column not in chunk.columns:
+                chunk[column] = ''
+        return chunk[SCAN_COLUMNS].fillna('').astype(str).apply(lambda s: s.str.strip())
+
+    @staticmethod
+    def _add_keys(df: pd.DataFrame) -> pd.DataFrame:
+        """照合キー列（正規化済み）の追加"""
+        df = df.copy()
+        df['key_ip'] = df['ip_address'].fillna('').astype(str).str.strip()
+        df['key_host'] = (
+            df['hostname'].fillna('').astype(str).str.strip().str.lower()
+            .str.rstrip('.').str.split('.', n=1).str[0]
+        )
+        df['key_mac'] = (
+            df['mac_address'].fillna('').astype(str).str.strip().str.lower()
+            .str.replace('-', ':', regex=False)
+        )
+        df['key_os'] = DiscoveryReconciler._os_key(df['os'])
+        return df
+
+    @staticmethod
+    def _os_key(os_names: pd.Series) -> pd.Series:
+        """OS の比較キー（種類と主バージョン。「Microsoft Windows Server 2019 Standard」は「windows server 2019」）"""
+        lowered = os_names.fillna('').astype(str).str.lower().str.replace(r'[^0-9a-z.]+', ' ', regex=True)
+        family = lowered.str.extract(r'^\s*(?:microsoft\s+)?([a-z]+(?:\s+server)?)', expand=False).fillna('')
+        major = lowered.str.extract(r'(\d+)', expand=False).fillna('')
+        return (family + ' ' + major).str.strip()
+
+    @staticmethod
+    def reconcile(scan_df: pd.DataFrame, inventory_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """スキャン結果と台帳の照合
+
+        MAC → ホスト名 → IP の順に結合し、各段階で未対応の行だけを次に回す。
+        戻り値:
+            missing: 台帳にあるがスキャンで検出されなかったサーバ
+            unknown: スキャンで検出されたが台帳にないホスト
+            changed: 対応付いたが OS（種類・主バージョン）または IP が異なるサーバ
+        """
+        scan = DiscoveryReconciler._add_keys(scan_df)
+        scan['scan_row'] = range(len(scan))
+        inventory = DiscoveryReconciler._add_keys(inventory_df)
+
+        remaining_scan = scan
+        remaining_inventory = inventory
+        matches = []
+        for key, label in MATCH_KEYS:
+            left = remaining_scan.loc[remaining_scan[key] != '', ['scan_row', key]]
+            right = remaining_inventory.loc[remaining_inventory[key] != '', ['id', key]]
+            matched = (
+                left.merge(right, on=key)
+                .drop_duplicates('scan_row')
+                .drop_duplicates('id')
+            )
+            matched['matched_by'] = label
+            matches.append(matched[['scan_row', 'id', 'matched_by']])
+            remaining_scan = remaining_scan[~remaining_scan['scan_row'].isin(matched['scan_row'])]
+            remaining_inventory = remaining_inventory[~remaining_inventory['id'].isin(matched['id'])]
+
+        pairs = (
+            pd.concat(matches, ignore_index=True)
+            .merge(scan.add_prefix('scan_').rename(columns={'scan_scan_row': 'scan_row'}), on='scan_row')
+            .merge(inventory, on='id')
+        )
+        ip_changed = (pairs['scan_key_ip'] != '') & (pairs['scan_key_ip'] != pairs['key_ip'])
+        os_changed = (pairs['scan_key_os'] != '') & (pairs['scan_key_os'] != pairs['key_os'])
+        changed = pairs[ip_changed | os_changed].assign(
+            ip_changed=ip_changed[ip_changed | os_changed],
+            os_changed=os_changed[ip_changed | os_changed],
+        )
+
+        return {
+            'missing': remaining_inventory[
+                ['id', 'model', 'location', 'ip_address', 'hostname', 'mac_address', 'os']
+            ].reset_index(drop=True),
+            'unknown': remaining_scan[SCAN_COLUMNS].reset_index(drop=True),
+            'changed': pd.DataFrame({
+                'id': changed['id'],
+                'version': changed['version'],
+                'model': changed['model'],
+                'location': changed['location'],
+                'matched_by': changed['matched_by'],
+                'ip_address': changed['ip_address'],
+                'new_ip_address': changed['scan_ip_address'].where(changed['ip_changed'], ''),
+                'os': changed['os'],
+                'new_os': changed['scan_os'].where(changed['os_changed'], ''),
+            }).reset_index(drop=True),
+        }
+
+    @staticmethod
+    def build_updates(changed_df: pd.DataFrame) -> list[tuple[int, int, Dict[str, Any], Dict[str, Any]]]:
+        """照合結果の変更行を ServerService.bulk_update_servers 用の更新リストに変換
+
+        apply_ip / apply_os 列があれば、True の項目だけを更新する。
+        """
+        updates = []
+        for row in changed_df.itertuples(index=False):
+            old_data, new_data = {}, {}
+            if row.new_ip_address and getattr(row, 'apply_ip', True):
+                old_data['ip_address'], new_data['ip_address'] = row.ip_address, row.new_ip_address
+            if row.new_os and getattr(row, 'apply_os', True):
+                old_data['os'], new_data['os'] = row.os, row.new_os
+            if new_data:
+                updates.append((int(row.id), int(row.version), old_data, new_data))
+        return updates
+
+
+def _iter_json_records(stream: TextIO, read_size: int = JSON_READ_SIZE) -> Iterator[Any]:
+    """JSON 配列の要素を1件ずつ読み込む（ファイル全体をメモリに載せない）
+
+    {"hosts": [...]} のように配列を値に持つオブジェクトの場合は、最初の配列の要素を返す。
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def read_more():
+        """未処理の部分を残して続きを読み足す"""
+        nonlocal buffer, pos, eof
+        chunk = stream.read(read_size)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+    def next_char() -> str:
+        """空白を読み飛ばした次の文字（終端では空文字）"""
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1]
+            read_more()
+
+    def take(expected: str) -> str:
+        """次の文字（expected のいずれか）を読み進める"""
+        nonlocal pos
+        char = next_char()
+        if not char or char not in expected:
+            raise json.JSONDecodeError(f"「{expected}」のいずれかが必要です", buffer, pos)
+        pos += 1
+        return char
+
+    def decode() -> Any:
+        """次の値を1つ読み込む（途中で切れていれば読み足す）"""
+        nonlocal pos
+        next_char()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                read_more()
+                continue
+            if end == len(buffer) and not eof:
+                # 数値は続きがある可能性があるため、区切りまで読んでから確定する
+                read_more()
+                continue
+            pos = end
+            return value
+
+    def elements() -> Iterator[Any]:
+        """配列の要素"""
+        take('[')
+        if next_char() == ']':
+            take(']')
+            return
+        while True:
+            yield decode()
+            if take(',]') == ']':
+                return
+
+    first = next_char()
+    if first == '[':
+        yield from elements()
+    elif first == '{':
+        take('{')
+        while next_char() not in ('}', ''):
+            decode()
+            take(':')
+            if next_char() == '[':
+                yield from elements()
+                return
+            decode()
+            if next_char() == ',':
+                take(',')
@@ -0,0 +1,324 @@
+"""
+リポジトリモジュール
+
+サーバ・編集履歴・ユーザー・楽観的ロックのデータアクセスを、バックエンドごとのリポジトリとしてまとめる。
+管理クラス（DatabaseManager・HistoryManager・AuthManager・OptimisticLockManager）は接続を直接扱わず、
+current() で現在のバックエンド（シャード処理中は use_backend の切り替え先）のリポジトリを取得して操作する。
+
+SQL は qmark 形式（?）で記述し、バックエンドで異なる部分（大文字小文字を区別しない比較・LIKE）は
+StorageBackend.nocase / StorageBackend.like から組み立てる。
+
+pandas に依存しない（DataFrame を返すメソッドはバックエンドが必要になった時点で読み込む）。
+"""
+from typing import Optional, Dict, Any, Iterator
+
+from accessories import ComponentIndex
+from config import FIELD_MAPPING
+from location_tree import LocationTree
+from storage import StorageBackend, get_backend
+from warranty import WarrantyPolicy
+
+SERVER_SELECT_QUERY = '''
+    SELECT
+        s.*,
+        u_created.name as created_by_name,
+        u_updated.name as updated_by_name
+    FROM servers s
+    LEFT JOIN users u_created ON s.created_by = u_created.email
+    LEFT JOIN users u_updated ON s.updated_by = u_updated.email
+'''
+
+# 登録・更新でまとめて書き込むサーバの項目
+SERVER_COLUMNS = (
+    'model', 'location', 'purchase_date', 'warranty_status', 'warranty_end_date',
+    'ip_address', 'hostname', 'mac_address', 'user_name', 'os', 'gpu_accessories', 'notes'
+)
+
+
+class Repository:
+    """リポジトリの基底クラス（1つのバックエンドに結び付く）"""
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+
+    @classmethod
+    def current(cls):
+        """現在のバックエンドのリポジトリを取得"""
+        return cls(get_backend())
+
+
+class ServerRepository(Repository):
+    """サーバ（servers と部品行 server_components）のリポジトリ"""
+
+    def select_frame(self, where_clause: str = '', params: list = (), limit: int = None):
+        """条件に一致するサーバを新しい順に DataFrame で取得（WHERE 句はパラメータ化済みであること）"""
+        query, params = self._build_select_query(where_clause, params)
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return self.backend.read_frame(query, params)
+
+    def iter_frames(self, chunksize: int, where_clause: str = '', params: list = ()) -> Iterator:
+        """条件に一致するサーバを chunksize 行ずつの DataFrame で取得"""
+        query, params = self._build_select_query(where_clause, params)
+        yield from self.backend.iter_frames(query, params, chunksize)
+
+    @staticmethod
+    def _build_select_query(where_clause: str, params: list) -> tuple[str, list]:
+        """サーバ取得クエリの組み立て"""
+        query = SERVER_SELECT_QUERY
+        if where_clause:
+            query += f' WHERE {where_clause}'
+        return query + ' ORDER BY s.id DESC', list(params)
+
+    def read_frame(self, query: str, params: list = ()):
+        """組み立て済みの集計クエリ（ファセット件数など）の結果を DataFrame で取得"""
+        return self.backend.read_frame(query, params)
+
+    def location_counts_frame(self, where_clause: str = '', params: list = ()):
+        """設置場所のパスごとの台数（location_path, location, count 列。location は表記の例）"""
+        where_sql = f' WHERE {where_clause}' if where_clause else ''
+        return self.backend.read_frame(f'''
+            SELECT s.location_path AS location_path, MIN(s.location) AS location, COUNT(*) AS count
+            FROM servers s{where_sql}
+            GROUP BY s.location_path
+        ''', params)
+
+    def gpu_totals_frame(self):
+        """設置場所・型番別の GPU 搭載数（location, model, servers, gpus, memory_gb 列）"""
+        return self.backend.read_frame(f'''
+            SELECT s.location AS location, c.model AS model,
+                   COUNT(DISTINCT c.server_id) AS servers,
+                   SUM(c.count) AS gpus,
+                   SUM(c.count * c.memory_gb) AS memory_gb
+            FROM server_components c
+            JOIN servers s ON s.id = c.server_id
+            WHERE c.type = 'GPU'
+            GROUP BY s.location{self.backend.nocase}, c.model
+            ORDER BY location, gpus DESC, model
+        ''')
+
+    def identities_frame(self):
+        """照合用にサーバの識別項目のみ取得"""
+        return self.backend.read_frame('''
+            SELECT id, version, model, location, ip_address, hostname, mac_address, os
+            FROM servers
+        ''')
+
+    def get(self, server_id: int) -> Optional[Any]:
+        """特定のサーバを取得"""
+        with self.backend.connect() as conn:
+            return conn.execute('SELECT * FROM servers WHERE id = ?', (server_id,)).fetchone()
+
+    def insert(self, server_data: Dict[str, Any], changed_by: Optional[str]) -> int:
+        """サーバの登録（server_data に id があればその ID で登録）"""
+        columns = list(SERVER_COLUMNS) + ['created_by', 'updated_by', 'location_path']
+        values = [server_data.get(column) for column in SERVER_COLUMNS] + [
+            changed_by, changed_by, LocationTree.path(server_data['location'])
+        ]
+        if server_data.get('id') is not None:
+            # シャード構成ではカタログで採番した ID を指定する
+            columns.insert(0, 'id')
+            values.insert(0, server_data['id'])
+
+        with self.backend.connect() as conn:
+            cursor = conn.execute(f'''
+                INSERT INTO servers ({', '.join(columns)})
+                VALUES ({', '.join('?' * len(columns))})
+                RETURNING id
+            ''', values)
+
+            server_id = cursor.fetchone()['id']
+            ComponentIndex.sync(conn, server_id, server_data['gpu_accessories'])
+            conn.commit()
+            return server_id
+
+    def update(self, server_id: int, new_data: Dict[str, Any], expected_version: int,
+               changed_by: Optional[str]) -> bool:
+        """サーバの更新（バージョンが一致しない場合は更新せず False を返す）"""
+        assignments = ', '.join(f'{column} = ?' for column in SERVER_COLUMNS)
+        with self.backend.connect() as conn:
+            # バージョンチェックと更新を同時に実行
+            cursor = conn.execute(f'''
+                UPDATE servers SET
+                    {assignments},
+                    location_path = ?,
+                    version = version + 1,
+                    updated_by = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND version = ?
+                RETURNING version
+            ''', [new_data.get(column) for column in SERVER_COLUMNS] + [
+                LocationTree.path(new_data['location']), changed_by, server_id, expected_version
+            ])
+
+            if cursor.fetchone() is None:
+                # バージョンが一致しない（他のユーザーが先に更新した）
+                return False
+
+            ComponentIndex.sync(conn, server_id, new_data['gpu_accessories'])
+            conn.commit()
+            return True
+
+    def bulk_update_fields(self, updates: list[tuple[int, int, Dict[str, Any]]],
+                           changed_by: Optional[str]) -> list[int]:
+        """複数サーバの項目を1トランザクションで更新（バージョンが一致した server_id のリストを返す）"""
+        applied = []
+        with self.backend.connect() as conn:
+            for server_id, expected_version, fields in updates:
+                columns = [column for column in fields if column in FIELD_MAPPING]
+                if not columns:
+                    continue
+                values = [fields[column] for column in columns]
+                if 'location' in columns:
+                    columns = columns + ['location_path']
+                    values.append(LocationTree.path(fields['location']))
+                assignments = ', '.join(f'{column} = ?' for column in columns)
+                cursor = conn.execute(f'''
+                    UPDATE servers SET
+                        {assignments},
+                        version = version + 1,
+                        updated_by = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND version = ?
+                    RETURNING id
+                ''', values + [changed_by, server_id, expected_version])
+                if cursor.fetchone() is not None:
+                    applied.append(server_id)
+                    if 'gpu_accessories' in columns:
+                        ComponentIndex.sync(conn, server_id, fields['gpu_accessories'])
+            conn.commit()
+        return applied
+
+    def delete(self, server_id: int, expected_version: int = None) -> Optional[str]:
+        """サーバの削除（expected_version 指定時はバージョン一致時のみ。削除したサーバの型番を返す）"""
+        with self.backend.connect() as conn:
+            server = conn.execute('SELECT model FROM servers WHERE id = ?', (server_id,)).fetchone()
+
+            if expected_version is None:
+                cursor = conn.execute('DELETE FROM servers WHERE id = ?', (server_id,))
+            else:
+                cursor = conn.execute(
+                    'DELETE FROM servers WHERE id = ? AND version = ?', (server_id, expected_version)
+                )
+            if cursor.rowcount:
+                ComponentIndex.delete(conn, [server_id])
+            conn.commit()
+
+            return server['model'] if server and cursor.rowcount else None
+
+    def refresh_warranty_status(self, changed_by: Optional[str]) -> list[tuple]:
+        """保守期限による保守契約状態の一括判定（状態を変更したサーバの履歴レコードを返す）"""
+        with self.backend.connect() as conn:
+            records = WarrantyPolicy.refresh(conn, changed_by)
+            conn.commit()
+        return records
+
+    def count(self) -> int:
+        """サーバの台数"""
+        with self.backend.connect() as conn:
+            return conn.execute('SELECT COUNT(*) as count FROM servers').fetchone()['count']
+
+
+class HistoryRepository(Repository):
+    """編集履歴（edit_history）のリポジトリ"""
+
+    def add(self, records: list[tuple], changed_by: Optional[str]):
+        """編集履歴の一括追加（1トランザクション）
+
+        records: (server_id, action, field_name, old_value, new_value) のリスト
+        """
+        with self.backend.connect() as conn:
+            conn.executemany('''
+                INSERT INTO edit_history (server_id, action, field_name, old_value, new_value, changed_by)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(*record, changed_by) for record in records])
+            conn.commit()
+
+    def select_frame(self, server_id: int = None):
+        """編集履歴を新しい順に DataFrame で取得（server_id 指定時はそのサーバのみ）"""
+        query, params = self._build_select_query(server_id)
+        return self.backend.read_frame(query, params)
+
+    def iter_frames(self, chunksize: int, server_id: int = None) -> Iterator:
+        """編集履歴を chunksize 行ずつの DataFrame で取得"""
+        query, params = self._build_select_query(server_id)
+        yield from self.backend.iter_frames(query, params, chunksize)
+
+    @staticmethod
+    def _build_select_query(server_id: int = None) -> tuple[str, list]:
+        """編集履歴取得クエリの組み立て"""
+        query = '''
+            SELECT
+                eh.id,
+                eh.server_id,
+                s.model as server_model,
+                eh.action,
+                eh.field_name,
+                eh.old_value,
+                eh.new_value,
+                u.name as changed_by_name,
+                eh.changed_by,
+                eh.changed_at
+            FROM edit_history eh
+            LEFT JOIN servers s ON eh.server_id = s.id
+            LEFT JOIN users u ON eh.changed_by = u.email
+        '''
+
+        params = []
+        if server_id:
+            query += ' WHERE eh.server_id = ?'
+            params.append(server_id)
+
+        query += ' ORDER BY eh.changed_at DESC'
+        return query, params
+
+    def count(self) -> int:
+        """編集履歴の件数"""
+        with self.backend.connect() as conn:
+            return conn.execute('SELECT COUNT(*) as count FROM edit_history').fetchone()['count']
+
+
+class UserRepository(Repository):
+    """ユーザー（users）のリポジトリ"""
+
+    def upsert(self, email: str, name: str, picture_url: str, last_login):
+        """ユーザーの登録・更新"""
+        with self.backend.connect() as conn:
+            conn.execute('''
+                INSERT INTO users (email, name, picture_url, last_login)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (email) DO UPDATE SET
+                    name = excluded.name,
+                    picture_url = excluded.picture_url,
+                    last_login = excluded.last_login
+            ''', (email, name, picture_url, last_login))
+            conn.commit()
+
+    def names(self) -> Dict[str, str]:
+        """メールアドレスと表示名の対応"""
+        with self.backend.connect() as conn:
+            return {row['email']: row['name'] for row in conn.execute('SELECT email, name FROM users')}
+
+    def count(self) -> int:
+        """ユーザー数"""
+        with self.backend.connect() as conn:
+            return conn.execute('SELECT COUNT(*) as count FROM users').fetchone()['count']
+
+
+class LockRepository(Repository):
+    """楽観的ロック（servers.version と最終更新者）のリポジトリ"""
+
+    def version(self, server_id: int) -> Optional[int]:
+        """サーバの現在のバージョン（存在しなければ None）"""
+        with self.backend.connect() as conn:
+            result = conn.execute('SELECT version FROM servers WHERE id = ?', (server_id,)).fetchone()
+            return result['version'] if result else None
+
+    def last_update(self, server_id: int) -> Optional[Any]:
+        """サーバの最終更新者・更新日時・バージョン（updated_by, updated_at, name, version 列）"""
+        with self.backend.connect() as conn:
+            return conn.execute('''
+                SELECT s.updated_by, s.updated_at, u.name, s.version
+                FROM servers s
+                LEFT JOIN users u ON s.updated_by = u.email
+                WHERE s.id = ?
+            ''', (server_id,)).fetchone()
@@ -1,38 +1,77 @@
 """
 サーバ業務ロジック
 """
-from typing import Dict, Any, Optional
+import string
+from datetime import date
+from typing import Dict, Any, Optional, Iterator
 import pandas as pd
 
+from auth import AuthManager
+from config import FIELD_MAPPING
 from database import DatabaseManager
+from filter_query import FilterQuery, FacetQuery, FILTER_FIELDS, FACET_FIELDS
 from history_manager import HistoryManager
 from lock_manager import OptimisticLockManager
+from reconciliation import DiscoveryReconciler
+from location_tree import LocationTree
+from shard_router import ShardRouter, site_of, site_of_prefix
+from warranty import WarrantyPolicy, JOB_USER
+
+# SQLite の COLLATE NOCASE と同じく ASCII の英字だけを小文字にそろえる変換表
+_NOCASE_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
 
 
 class ServerService:
-    """サーバに関する業務ロジックを管理するクラス"""
+    """サーバに関する業務ロジックを管理するクラス
+
+    サイト別シャードが有効な場合は、サーバ単位の操作はそのサーバのシャードで、
+    一覧・検索・集計は対象シャードに並列に問い合わせて結合する。
+    """
 
     def __init__(self):
         self.db_manager = DatabaseManager()
         self.history_manager = HistoryManager()
         self.lock_manager = OptimisticLockManager()
+        self.shard_router = ShardRouter.get()
 
     def get_all_servers(self) -> pd.DataFrame:
         """全サーバ情報の取得"""
-        return self.db_manager.get_servers()
+        return self._merge_servers(self.shard_router.gather(self.db_manager.get_servers))
 
     def get_server_by_id(self, server_id: int) -> Optional[Dict[str, Any]]:
         """特定のサーバ情報を取得"""
-        server = self.db_manager.get_server_by_id(server_id)
+        with self.shard_router.scope_for_server(server_id):
+            server = self.db_manager.get_server_by_id(server_id)
         return dict(server) if server else None
 
+    def get_servers_by_ids(self, server_ids: list[int]) -> pd.DataFrame:
+        """ID を指定してサーバ情報を取得"""
+        if not server_ids:
+            return self.db_manager.query_servers('0 = 1', [])
+        where_clause = f"s.id IN ({', '.join('?' * len(server_ids))})"
+        return self._merge_servers(self.shard_router.gather(
+            lambda: self.db_manager.query_servers(where_clause, server_ids)
+        ))
+
     def create_server(self, server_data: Dict[str, Any]) -> int:
         """新規サーバの作成"""
-        # サーバ追加
-        server_id = self.db_manager.add_server(server_data)
+        server_data = WarrantyPolicy.apply(server_data)
+        with self.shard_router.scope_for_location(server_data['location']):
+            if self.shard_router.enabled:
+                server_data = {
+                    **server_data, 'id': self.shard_router.allocate_id(site_of(server_data['location']))
+                }
 
-        # 履歴記録
-        self.history_manager.record_server_creation(server_id, server_data['model'])
+            # サーバ追加
+            try:
+                server_id = self.db_manager.add_server(server_data)
+            except Exception:
+                if self.shard_router.enabled:
+                    self.shard_router.release_id(server_data['id'])
+                raise
+
+            # 履歴記録
+            self.history_manager.record_server_creation(server_id, server_data['model'])
 
         return server_id
 
@@ -40,55 +79,311 @@ class ServerService:
         """サーバ情報の更新（楽観的ロック）"""
         try:
             expected_version = old_data.get('version', 1)
+            new_data = WarrantyPolicy.apply(new_data)
+
+            if self._changes_site(server_id, new_data):
+                # サイトが変わる場合は履歴ごと移動先のシャードへ移す
+                success = self._move_server(server_id, expected_version, old_data, new_data)
+            else:
+                with self.shard_router.scope_for_server(server_id):
+                    # 楽観的ロックによる更新
+                    success = self.db_manager.update_server(server_id, new_data, expected_version)
 
-            # 楽観的ロックによる更新
-            success = self.db_manager.update_server(server_id, new_data, expected_version)
+                    # 履歴記録
+                    if success:
+                        self.history_manager.record_server_update(server_id, old_data, new_data)
 
             if not success:
                 # バージョン競合が発生
-                conflict_info = self.lock_manager.get_conflict_info(server_id)
+                with self.shard_router.scope_for_server(server_id):
+                    conflict_info = self.lock_manager.get_conflict_info(server_id)
                 if conflict_info:
                     return False, f"他のユーザー（{conflict_info['user_name']}）が先に更新しました。\n更新日時: {conflict_info['updated_at']}"
                 else:
                     return False, "サーバが存在しないか、既に削除されています。"
 
-            # 履歴記録
-            self.history_manager.record_server_update(server_id, old_data, new_data)
-
             return True, "更新が完了しました。"
 
         except Exception as e:
             print(f"Error updating server: {e}")
             return False, "更新中にエラーが発生しました。"
 
-    def delete_server(self, server_id: int, user_email: str) -> bool:
-        """サーバの削除"""
+    def bulk_update_servers(self, updates: list[tuple[int, int, Dict[str, Any], Dict[str, Any]]]) -> tuple[int, int]:
+        """複数サーバの一括更新（楽観的ロック）
+
+        updates: (server_id, expected_version, 変更前の値, 変更後の値) のリスト
+        戻り値は (更新件数, 競合でスキップした件数)
+        """
+        applied_count = 0
+        by_site: Dict[Optional[str], list] = {}
+        for server_id, version, old_data, new_data in updates:
+            new_data = WarrantyPolicy.apply(new_data)
+            if self._changes_site(server_id, new_data):
+                applied_count += self._move_server(server_id, version, old_data, new_data)
+            else:
+                site = self.shard_router.locate(server_id) if self.shard_router.enabled else None
+                by_site.setdefault(site, []).append((server_id, version, old_data, new_data))
+
+        for site, site_updates in by_site.items():
+            with self.shard_router.scope_for_server(site_updates[0][0]):
+                applied = set(self.db_manager.bulk_update_fields(
+                    [(server_id, version, new_data) for server_id, version, _, new_data in site_updates]
+                ))
+
+                # 履歴記録
+                records = []
+                for server_id, _, old_data, new_data in site_updates:
+                    if server_id in applied:
+                        records.extend(self.history_manager.build_update_records(server_id, old_data, new_data))
+                self.history_manager.add_history_records(records)
+            applied_count += len(applied)
+
+        return applied_count, len(updates) - applied_count
+
+    def _changes_site(self, server_id: int, new_data: Dict[str, Any]) -> bool:
+        """更新によってサーバの属するシャードが変わるか"""
+        if not self.shard_router.enabled or 'location' not in new_data:
+            return False
+        current_site = self.shard_router.locate(server_id)
+        return current_site is not None and site_of(new_data['location']) != current_site
+
+    def _move_server(self, server_id: int, expected_version: int,
+                     old_data: Dict[str, Any], new_data: Dict[str, Any]) -> bool:
+        """別サイトのシャードへの移動を伴う更新"""
+        fields = {field: new_data[field] for field in FIELD_MAPPING if field in new_data}
+        return self.shard_router.move_server(
+            server_id, expected_version, fields,
+            self.history_manager.build_update_records(server_id, old_data, new_data),
+            AuthManager.get_current_email()
+        )
+
+    def refresh_warranty_status(self) -> int:
+        """保守期限による保守契約状態の一括判定（シャードごとに1回の UPDATE と1回の履歴追加。変更した台数を返す）"""
+        def refresh() -> int:
+            with AuthManager.acting_as(JOB_USER):
+                records = self.db_manager.refresh_warranty_status()
+                self.history_manager.add_history_records(records)
+            return len(records)
+
+        return sum(self.shard_router.gather(refresh))
+
+    def get_expiring_servers(self, days: int) -> pd.DataFrame:
+        """days 日以内に保守期限を迎えるサーバ（保守期限の早い順）"""
+        lower, upper = WarrantyPolicy.expiring_range(days)
+        frames = self.shard_router.gather(lambda: self.db_manager.query_servers(
+            's.warranty_end_date >= ? AND s.warranty_end_date <= ?', [lower, upper]
+        ))
+        return self._merge_servers(frames).sort_values(
+            ['warranty_end_date', 'id'], kind='stable', ignore_index=True
+        )
+
+    def reconcile_discovery(self, scan_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """ディスカバリ結果と台帳の照合"""
+        inventory = pd.concat(
+            self.shard_router.gather(self.db_manager.get_server_identities), ignore_index=True
+        )
+        return DiscoveryReconciler.reconcile(scan_df, inventory)
+
+    def apply_reconciliation(self, changed_df: pd.DataFrame) -> tuple[int, int]:
+        """照合で検出した OS・IP の変更を一括反映"""
+        return self.bulk_update_servers(DiscoveryReconciler.build_updates(changed_df))
+
+    def delete_server(self, server_id: int, user_email: str, expected_version: int = None) -> bool:
+        """サーバの削除（削除対象がない・バージョン不一致の場合は False）"""
         try:
-            # サーバ削除
-            model = self.db_manager.delete_server(server_id)
+            with self.shard_router.scope_for_server(server_id):
+                # サーバ削除
+                model = self.db_manager.delete_server(server_id, expected_version)
 
-            # 履歴記録
-            if model:
-                self.history_manager.record_server_deletion(server_id, model)
+                # 履歴記録
+                if model:
+                    self.history_manager.record_server_deletion(server_id, model)
 
-            return True
+            if model is not None and self.shard_router.enabled:
+                self.shard_router.release_id(server_id)
+            return model is not None
         except Exception as e:
             print(f"Error deleting server: {e}")
             return False
 
-    def search_servers(self, df: pd.DataFrame, search_term: str) -> pd.DataFrame:
-        """サーバ検索"""
-        if not search_term:
-            return df
+    def search_servers(self, search_term: str,
+                       facet_selections: Dict[str, list[str]] = None) -> pd.DataFrame:
+        """フィルタ構文とファセット選択によるサーバ検索（構文エラー時は FilterSyntaxError）"""
+        where_clause, params = FilterQuery.to_sql(search_term)
+        facet_clause, facet_params = FacetQuery.compile(facet_selections or {})
+        if not where_clause and not facet_clause:
+            return self.get_all_servers()
+
+        clauses = [f'({clause})' for clause in (where_clause, facet_clause) if clause]
+        return self._merge_servers(self.shard_router.gather(
+            lambda: self.db_manager.query_servers(' AND '.join(clauses), params + facet_params),
+            self._target_sites(search_term, facet_selections)
+        ))
+
+    def list_servers_page(self, search_term: str, before_id: int = None,
+                          limit: int = 100) -> pd.DataFrame:
+        """ID の降順によるカーソルページング（before_id より小さい ID を limit 件）"""
+        where_clause, params = FilterQuery.to_sql(search_term)
+        if before_id is not None:
+            where_clause = f'({where_clause}) AND s.id < ?' if where_clause else 's.id < ?'
+            params = params + [before_id]
+        return self._merge_servers(self.shard_router.gather(
+            lambda: self.db_manager.query_servers(where_clause, params, limit=limit),
+            self._target_sites(search_term)
+        ), limit)
+
+    def iter_search_results(self, search_term: str, chunksize: int) -> Iterator[pd.DataFrame]:
+        """検索結果をチャンク単位で取得（シャード構成ではサイトごとに順に返す）"""
+        where_clause, params = FilterQuery.to_sql(search_term)
+        for chunk in self.shard_router.iterate(
+            lambda: self.db_manager.iter_servers(chunksize, where_clause, params),
+            self._target_sites(search_term)
+        ):
+            yield self._fill_user_names(chunk, {'created_by': 'created_by_name', 'updated_by': 'updated_by_name'})
+
+    def get_facet_counts(self, search_term: str,
+                         facet_selections: Dict[str, list[str]] = None) -> pd.DataFrame:
+        """ファセットごとの値別件数の取得（facet, value, count 列）"""
+        where_clause, params = FilterQuery.to_sql(search_term)
+        count_query, count_params = FacetQuery.build_count_query(
+            where_clause, params, facet_selections or {}
+        )
+        frames = self.shard_router.gather(
+            lambda: self.db_manager.get_facet_counts(count_query, count_params),
+            self._target_sites(search_term)
+        )
+        if len(frames) == 1:
+            return frames[0]
+
+        # 単一データベースと同じ件数になるよう、COLLATE NOCASE で集計するファセットは
+        # 大文字小文字をそろえた値で合算し、表示する値は件数が最も多い表記を使う
+        counts = pd.concat(frames, ignore_index=True).sort_values('count', ascending=False, kind='stable')
+        nocase = counts['facet'].map(lambda facet: FACET_FIELDS[facet][2])
+        counts['key'] = [
+            value.translate(_NOCASE_FOLD) if fold and isinstance(value, str) else value
+            for value, fold in zip(counts['value'], nocase)
+        ]
+        return (
+            counts.groupby(['facet', 'key'], as_index=False, sort=False)
+            .agg(value=('value', 'first'), count=('count', 'sum'))[['facet', 'value', 'count']]
+            .sort_values(['facet', 'count', 'value'], ascending=[True, False, True], ignore_index=True)
+        )
 
-        mask = df.astype(str).apply(
-            lambda x: x.str.contains(search_term, case=False, na=False)
-        ).any(axis=1)
-        return df[mask]
+    def get_location_tree(self, search_term: str,
+                          facet_selections: Dict[str, list[str]] = None) -> pd.DataFrame:
+        """設置場所の階層ノードごとの台数（path, name, level, depth, count 列。配下を含む・パス順）"""
+        where_clause, params = FilterQuery.to_sql(search_term)
+        facet_clause, facet_params = FacetQuery.compile(facet_selections or {})
+        clauses = [f'({clause})' for clause in (where_clause, facet_clause) if clause]
+        frames = self.shard_router.gather(
+            lambda: self.db_manager.get_location_counts(' AND '.join(clauses), params + facet_params),
+            self._target_sites(search_term, facet_selections)
+        )
+        counts = pd.concat(frames, ignore_index=True)
+        nodes = LocationTree.build(counts[['location_path', 'location', 'count']].itertuples(index=False))
+        return pd.DataFrame(nodes, columns=['path', 'name', 'level', 'depth', 'count'])
+
+    def get_generation(self) -> int:
+        """サーバのデータ世代（シャード構成では全シャードの合計。どのシャードの変更でも増加する）"""
+        return sum(self.shard_router.gather(self.db_manager.get_generation))
+
+    def get_user_generation(self) -> int:
+        """ユーザーのデータ世代（作成者・更新者の表示名の変更を検出する。ユーザーは既定のデータベースにのみ存在する）"""
+        return self.db_manager.get_generation('users')
 
     def get_statistics(self) -> Dict[str, int]:
         """統計情報の取得"""
-        return self.db_manager.get_statistics()
+        results = self.shard_router.gather(self.db_manager.get_statistics)
+        statistics = {key: sum(result[key] for result in results) for key in ('servers', 'history')}
+        # ユーザーは既定のデータベースにのみ存在する
+        statistics['users'] = self.db_manager.get_statistics()['users']
+        return statistics
+
+    def get_gpu_totals(self) -> pd.DataFrame:
+        """設置場所・型番別の GPU 搭載数"""
+        frames = self.shard_router.gather(self.db_manager.get_gpu_totals)
+        if len(frames) == 1:
+            return frames[0]
+        return (
+            pd.concat(frames, ignore_index=True)
+            .groupby(['location', 'model'], as_index=False)[['servers', 'gpus', 'memory_gb']].sum(min_count=1)
+            .sort_values(['location', 'gpus', 'model'], ascending=[True, False, True], ignore_index=True)
+        )
+
+    def get_server_history(self, server_id: int = None) -> pd.DataFrame:
+        """編集履歴の取得（server_id 省略時は全サーバ）"""
+        if server_id is not None:
+            with self.shard_router.scope_for_server(server_id):
+                history = self.history_manager.get_server_history(server_id)
+        else:
+            frames = self.shard_router.gather(self.history_manager.get_server_history)
+            history = frames[0] if len(frames) == 1 else (
+                pd.concat(frames, ignore_index=True)
+                .sort_values('changed_at', ascending=False, kind='stable', ignore_index=True)
+            )
+        return self._fill_user_names(history, {'changed_by': 'changed_by_name'})
+
+    def iter_server_history(self, chunksize: int) -> Iterator[pd.DataFrame]:
+        """編集履歴をチャンク単位で取得（シャード構成ではサイトごとに順に返す）"""
+        for chunk in self.shard_router.iterate(lambda: self.history_manager.iter_server_history(chunksize)):
+            yield self._fill_user_names(chunk, {'changed_by': 'changed_by_name'})
+
+    def _target_sites(self, search_term: str,
+                      facet_selections: Dict[str, list[str]] = None) -> Optional[set[str]]:
+        """検索条件から対象サイトを絞り込む（絞り込めない場合は None = 全サイト）
+
+        設置場所の完全一致、サイト名を含む前方一致（「東京DC/*」など）、階層の指定（under:）、
+        設置場所ファセットの選択を使う。
+        """
+        if not self.shard_router.enabled:
+            return None
+
+        constraints = []
+        for term in FilterQuery.parse(search_term):
+            if term.negate or term.field is None or term.op not in (':', '='):
+                continue
+            column, kind = FILTER_FIELDS[term.field]
+            value = term.value
+            if kind == 'path':
+                # 階層の先頭はサイト名
+                constraints.append({site_of(value)})
+                continue
+            if column != 'location':
+                continue
+            if '*' not in value:
+                constraints.append({site_of(value)})
+            elif value.endswith('*') and '*' not in value[:-1] and site_of_prefix(value[:-1]):
+                constraints.append({site_of_prefix(value[:-1])})
+
+        locations = (facet_selections or {}).get('location') or []
+        if locations and all(locations):
+            constraints.append({site_of(location) for location in locations})
+
+        if not constraints:
+            return None
+        return set.intersection(*constraints)
+
+    def _merge_servers(self, frames: list[pd.DataFrame], limit: int = None) -> pd.DataFrame:
+        """シャードごとの検索結果を ID の降順に結合"""
+        if len(frames) == 1:
+            merged = frames[0]
+        else:
+            merged = pd.concat(frames, ignore_index=True).sort_values(
+                'id', ascending=False, kind='stable', ignore_index=True
+            )
+            if limit is not None:
+                merged = merged.head(limit)
+        return self._fill_user_names(merged, {'created_by': 'created_by_name', 'updated_by': 'updated_by_name'})
+
+    def _fill_user_names(self, df: pd.DataFrame, columns: Dict[str, str]) -> pd.DataFrame:
+        """シャードには users テーブルがないため、既定のデータベースのユーザー名で補完"""
+        if not self.shard_router.enabled or df.empty:
+            return df
+        names = self.db_manager.get_user_names()
+        df = df.copy()
+        for email_column, name_column in columns.items():
+            df[name_column] = df[email_column].map(names.get)
+        return df
 
     def validate_server_data(self, server_data: Dict[str, Any]) -> tuple[bool, str]:
         """サーバデータのバリデーション"""
@@ -98,8 +393,16 @@ class ServerService:
         if not server_data.get('location'):
             return False, "設置場所は必須項目です。"
 
+        if server_data.get('warranty_end_date'):
+            try:
+                date.fromisoformat(str(server_data['warranty_end_date']))
+            except ValueError:
+                return False, "保守期限は YYYY-MM-DD 形式で入力してください。"
+
         return True, ""
 
     def check_version_conflict(self, server_id: int, expected_version: int) -> bool:
         """バージョン競合をチェック"""
-        return self.lock_manager.check_version_conflict(server_id, expected_version)
+        with self.shard_router.scope_for_server(server_id):
+            return self.lock_manager.check_version_conflict(server_id, expected_version)
+
@@ -0,0 +1,491 @@
+"""
+サイト別シャードモジュール
+
+SHARD_DIR を設定すると、サーバと編集履歴を設置場所のサイト（location_tree による階層の先頭。
+例: 「東京DC/B棟/R12」→「東京DC」）ごとに別々の SQLite ファイルへ格納する。
+ユーザー・ジョブなどは従来どおり既定のデータベースに置く。
+
+- サーバ ID はカタログ（SHARD_DIR/catalog.db）で全シャード共通に採番し、ID からシャードを引く
+- 1サイトに絞れる検索はそのシャードだけに問い合わせ、それ以外はスレッドプールで全シャードに並列に問い合わせて結合する
+- サイトをまたぐ移動は、移動先への複製・カタログの更新・移動元からの削除の順に段階ごとにコミットし、
+  中断した場合は repair で1か所にまとめる
+
+既存の単一データベースをシャードに分割する場合:
+
+    SHARD_DIR=shards python shard_router.py split
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Optional, Dict, Any, Callable, Iterable, Iterator
+
+from accessories import ComponentIndex, COMPONENT_COLUMNS
+from config import SHARD_DIR, SHARD_MAX_WORKERS
+from location_tree import LocationTree, SEPARATOR
+from storage import SQLiteBackend, get_default_backend, use_backend
+
+UNKNOWN_SITE = '(未設定)'
+
+# サイトをまたいで移動するときに複製する履歴の列（ID は移動先で採番し直す）
+_HISTORY_COLUMNS = 'server_id, action, field_name, old_value, new_value, changed_by, changed_at'
+
+
+def site_of(location: Optional[str]) -> str:
+    """設置場所からサイト名（シャードのキー。設置場所の階層パスの先頭の要素）を取得"""
+    segments = LocationTree.segments(location)
+    return segments[0].lower() if segments else UNKNOWN_SITE
+
+
+def site_of_prefix(prefix: str) -> Optional[str]:
+    """設置場所の前方一致条件からサイト名を取得（サイト名の後に区切りがなく確定できない場合は None）"""
+    parts = SEPARATOR.split(prefix)
+    while parts and not parts[0].strip():
+        # 先頭の区切り（「/東京DC/」）の前の空の要素
+        parts.pop(0)
+    return site_of(parts[0]) if len(parts) > 1 else None
+
+
+class ShardRouter:
+    """サイト別シャードへの振り分けを行うクラス
+
+    SHARD_DIR 未設定時は無効で、scope_for_* は何もせず、gather() / iterate() は既定のデータベースで1回だけ実行する。
+    シャードがまだ1つもない場合も既定のデータベース（空のテーブル）で実行し、空の結果の形をそろえる。
+    """
+
+    _instance: Optional['ShardRouter'] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, shard_dir: Optional[str], max_workers: int = SHARD_MAX_WORKERS):
+        self.shard_dir = shard_dir
+        self.enabled = bool(shard_dir)
+        self._lock = threading.Lock()
+        self._backends: Dict[str, SQLiteBackend] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._max_workers = max_workers
+        if self.enabled:
+            os.makedirs(shard_dir, exist_ok=True)
+            self.catalog_path = os.path.join(shard_dir, 'catalog.db')
+            with self._catalog() as conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS shards (
+                        site TEXT PRIMARY KEY,
+                        filename TEXT NOT NULL UNIQUE
+                    )
+                ''')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS server_sites (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        site TEXT NOT NULL
+                    )
+                ''')
+                conn.commit()
+
+    @classmethod
+    def get(cls) -> 'ShardRouter':
+        """設定に従ったルーターの取得（プロセスごとに1つ）"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls(SHARD_DIR)
+        return cls._instance
+
+    @contextmanager
+    def _catalog(self):
+        """カタログ接続のコンテキストマネージャー"""
+        conn = sqlite3.connect(self.catalog_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # --- シャードの特定 ---
+
+    def backend_for_site(self, site: str, create: bool = True) -> Optional[SQLiteBackend]:
+        """サイトのシャードを取得（create=True なら未作成のシャードを作成）"""
+        with self._lock:
+            backend = self._backends.get(site)
+            if backend is not None:
+                return backend
+
+            with self._catalog() as conn:
+                row = conn.execute('SELECT filename FROM shards WHERE site = ?', (site,)).fetchone()
+                if row is None:
+                    if not create:
+                        return None
+                    filename = self._register_site(conn, site)
+                else:
+                    filename = row['filename']
+
+            backend = SQLiteBackend(os.path.join(self.shard_dir, filename))
+            backend.init_schema()
+            self._backends[site] = backend
+            return backend
+
+    @staticmethod
+    def _register_site(conn, site: str) -> str:
+        """サイトをカタログに登録してシャードのファイル名を返す
+
+        ファイル名はカタログの rowid から作る。他のプロセスが同時に同じサイトを登録した場合は、
+        書き込みロックを取得した後に読み直してそのファイル名を使う。
+        """
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT filename FROM shards WHERE site = ?', (site,)).fetchone()
+            if row is not None:
+                conn.rollback()
+                return row['filename']
+            rowid = conn.execute(
+                "INSERT INTO shards (site, filename) VALUES (?, '') RETURNING rowid", (site,)
+            ).fetchone()[0]
+            filename = f"site_{rowid:04d}.db"
+            conn.execute('UPDATE shards SET filename = ? WHERE rowid = ?', (filename, rowid))
+            conn.commit()
+            return filename
+        except Exception:
+            conn.rollback()
+            raise
+
+    def sites(self) -> list[str]:
+        """登録済みのサイト一覧"""
+        with self._catalog() as conn:
+            return [row['site'] for row in conn.execute('SELECT site FROM shards ORDER BY filename')]
+
+    def backends(self) -> list[SQLiteBackend]:
+        """登録済みの全シャードのバックエンド（バックアップ・メンテナンス用）"""
+        return self._targets(None)
+
+    def locate(self, server_id: int) -> Optional[str]:
+        """サーバ ID が属するサイトの取得"""
+        with self._catalog() as conn:
+            row = conn.execute('SELECT site FROM server_sites WHERE id = ?', (server_id,)).fetchone()
+            return row['site'] if row else None
+
+    def allocate_id(self, site: str) -> int:
+        """全シャード共通のサーバ ID を採番"""
+        with self._catalog() as conn:
+            server_id = conn.execute(
+                'INSERT INTO server_sites (site) VALUES (?) RETURNING id', (site,)
+            ).fetchone()['id']
+            conn.commit()
+            return server_id
+
+    def release_id(self, server_id: int):
+        """削除したサーバの ID をカタログから除く"""
+        with self._catalog() as conn:
+            conn.execute('DELETE FROM server_sites WHERE id = ?', (server_id,))
+            conn.commit()
+
+    # --- 実行先の切り替え ---
+
+    def scope_for_server(self, server_id: int):
+        """サーバが属するシャードで実行するためのコンテキスト（存在しない ID は既定のまま）"""
+        if not self.enabled:
+            return nullcontext()
+        site = self.locate(server_id)
+        backend = self.backend_for_site(site, create=False) if site else None
+        return use_backend(backend) if backend else nullcontext()
+
+    def scope_for_location(self, location: Optional[str]):
+        """設置場所のシャードで実行するためのコンテキスト"""
+        if not self.enabled:
+            return nullcontext()
+        return use_backend(self.backend_for_site(site_of(location)))
+
+    def _targets(self, sites: Optional[Iterable[str]]) -> list[SQLiteBackend]:
+        """対象シャードの一覧（sites=None は全シャード、未作成のサイトは除く）"""
+        names = self.sites() if sites is None else sites
+        return [backend for backend in (self.backend_for_site(site, create=False) for site in names) if backend]
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """並列問い合わせ用スレッドプールの取得（初回のみ生成）"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_workers, thread_name_prefix="shard"
+                )
+            return self._executor
+
+    def gather(self, func: Callable[[], Any], sites: Optional[Iterable[str]] = None) -> list[Any]:
+        """func を対象シャードごとに並列実行し、結果のリストを返す"""
+        backends = self._targets(sites) if self.enabled else []
+        if not backends:
+            return [func()]
+
+        def call(backend):
+            with use_backend(backend):
+                return func()
+
+        if len(backends) == 1:
+            return [call(backend) for backend in backends]
+        return list(self._get_executor().map(call, backends))
+
+    def iterate(self, func: Callable[[], Iterator[Any]], sites: Optional[Iterable[str]] = None) -> Iterator[Any]:
+        """チャンクを返すジェネレータ func を対象シャードごとに順に実行"""
+        backends = self._targets(sites) if self.enabled else []
+        if not backends:
+            yield from func()
+            return
+
+        yielded = False
+        empty_chunk = None
+        for backend in backends:
+            # 呼び出し側の処理（進捗の書き込みなど）は既定のデータベースで行うよう、
+            # シャードへの切り替えはチャンクを取り出す間だけにする
+            with use_backend(backend):
+                iterator = iter(func())
+            while True:
+                with use_backend(backend):
+                    chunk = next(iterator, None)
+                if chunk is None:
+                    break
+                if len(chunk) == 0:
+                    # 空のシャードのチャンクは飛ばし、全シャードが空の場合だけ1つ返す
+                    empty_chunk = chunk
+                    continue
+                yielded = True
+                yield chunk
+
+        if not yielded and empty_chunk is not None:
+            yield empty_chunk
+
+    # --- サイトをまたぐ移動 ---
+
+    def move_server(self, server_id: int, expected_version: int, fields: Dict[str, Any],
+                    history_records: list[tuple], changed_by: Optional[str]) -> bool:
+        """サーバを別サイトのシャードへ移動（楽観的ロック）
+
+        fields（新しい location を含む）を適用した行と、それまでの履歴・今回の変更履歴を次の順に書き込む。
+        WAL モードでは ATTACH した複数ファイルへのコミットが不可分にならないため、段階ごとにコミットし、
+        どの段階で中断しても行が少なくとも1つのシャードに残るようにする（残った重複は repair() で解消する）。
+
+        1. 移動先に複製してコミット（以前の中断で残った複製は置き換える）
+        2. カタログの所属サイトを移動先に変更してコミット
+        3. 移動元から削除してコミット
+
+        移動元の書き込みロックは最初に取得して移動が終わるまで保持するため、移動中の行は他から更新されない。
+        1 と 3 の間は全シャードへの問い合わせに同じサーバが2行現れることがある。
+        """
+        source_site = self.locate(server_id)
+        target_site = site_of(fields['location'])
+        if source_site is None:
+            return False
+        source = self.backend_for_site(source_site)
+        target = self.backend_for_site(target_site)
+
+        with source.connect() as conn:
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT * FROM servers WHERE id = ? AND version = ?', (server_id, expected_version)
+                ).fetchone()
+                if row is None:
+                    conn.rollback()
+                    return False
+                history = conn.execute(
+                    f'SELECT {_HISTORY_COLUMNS} FROM edit_history WHERE server_id = ? ORDER BY id', (server_id,)
+                ).fetchall()
+
+                data = dict(row)
+                data.update(fields)
+                data['location_path'] = LocationTree.path(data['location'])
+                data['version'] = expected_version + 1
+                data['updated_by'] = changed_by
+                columns = [column for column in data if column != 'updated_at']
+                with target.connect() as target_conn:
+                    target_conn.execute('PRAGMA synchronous=FULL')
+                    self._delete_servers(target_conn, [server_id])
+                    target_conn.execute(
+                        f"INSERT INTO servers ({', '.join(columns)}, updated_at) "
+                        f"VALUES ({', '.join('?' * len(columns))}, CURRENT_TIMESTAMP)",
+                        [data[column] for column in columns]
+                    )
+                    target_conn.executemany(
+                        f"INSERT INTO edit_history ({_HISTORY_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [tuple(record) for record in history]
+                    )
+                    target_conn.executemany('''
+                        INSERT INTO edit_history (server_id, action, field_name, old_value, new_value, changed_by)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', [(*record, changed_by) for record in history_records])
+                    target_conn.executemany(
+                        ComponentIndex.INSERT_SQL, ComponentIndex.rows(server_id, data['gpu_accessories'])
+                    )
+                    target_conn.commit()
+
+                with self._catalog() as catalog:
+                    catalog.execute('PRAGMA synchronous=FULL')
+                    catalog.execute('UPDATE server_sites SET site = ? WHERE id = ?', (target_site, server_id))
+                    catalog.commit()
+
+                self._delete_servers(conn, [server_id])
+                conn.commit()
+                return True
+            except Exception:
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def _delete_servers(conn, server_ids: list[int]):
+        """シャード内のサーバ行と、その履歴・部品行の削除（コミットは呼び出し側で行う）"""
+        ComponentIndex.delete(conn, server_ids)
+        for server_id in server_ids:
+            conn.execute('DELETE FROM edit_history WHERE server_id = ?', (server_id,))
+            conn.execute('DELETE FROM servers WHERE id = ?', (server_id,))
+
+    def _has_server(self, site: str, server_id: int) -> bool:
+        """サイトのシャードにサーバの行があるか"""
+        backend = self.backend_for_site(site, create=False)
+        if backend is None:
+            return False
+        with backend.connect() as conn:
+            return conn.execute('SELECT 1 FROM servers WHERE id = ?', (server_id,)).fetchone() is not None
+
+    def repair(self) -> int:
+        """移動の中断でカタログと異なるシャードに残ったサーバを1か所にまとめる（処理した台数を返す）
+
+        カタログの所属サイトのシャードに行があれば、それ以外のシャードの行を削除する。
+        所属サイトのシャードに行がなければ（移動先への書き込みが反映されていなければ）、
+        残っている行を正としてカタログの所属サイトをそのシャードに戻す。
+        """
+        repaired = 0
+        for site in self.sites():
+            backend = self.backend_for_site(site)
+            with backend.connect() as conn:
+                conn.execute('ATTACH DATABASE ? AS catalog', (self.catalog_path,))
+                stale = conn.execute('''
+                    SELECT s.id, c.site FROM servers s
+                    JOIN catalog.server_sites c ON c.id = s.id
+                    WHERE c.site != ?
+                ''', (site,)).fetchall()
+                conn.execute('DETACH DATABASE catalog')
+
+                duplicates = [server_id for server_id, owner in stale if self._has_server(owner, server_id)]
+                orphans = [server_id for server_id, owner in stale if server_id not in duplicates]
+                if orphans:
+                    with self._catalog() as catalog:
+                        catalog.executemany(
+                            'UPDATE server_sites SET site = ? WHERE id = ?', [(site, i) for i in orphans]
+                        )
+                        catalog.commit()
+                self._delete_servers(conn, duplicates)
+                conn.commit()
+                repaired += len(stale)
+        return repaired
+
+    def rebalance(self) -> int:
+        """設置場所から求めたサイトと異なるシャードにあるサーバを移動（移動した台数を返す）
+
+        サイト名の規則を変えた後（空白を区切りとしなくなった場合など）に実行する。
+        """
+        moved = 0
+        for site in self.sites():
+            backend = self.backend_for_site(site)
+            with backend.connect() as conn:
+                rows = conn.execute('SELECT id, version, location, updated_by FROM servers').fetchall()
+            for row in rows:
+                if site_of(row['location']) != site and self.move_server(
+                    row['id'], row['version'], {'location': row['location']}, [], row['updated_by']
+                ):
+                    moved += 1
+        return moved
+
+    # --- 既存データの分割 ---
+
+    def split(self, source=None, chunksize: int = 10000) -> Dict[str, int]:
+        """単一データベースのサーバと履歴を、ID を保ったままサイト別シャードに分割
+
+        分割済みのサーバは飛ばすため、途中で中断しても再実行できる。
+        カタログの採番は登録した最大の ID の続きから始まる。
+        """
+        source = source or get_default_backend()
+        counts: Dict[str, int] = {}
+        with source.connect() as conn:
+            cursor = conn.execute('SELECT * FROM servers ORDER BY id')
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                by_site: Dict[str, list] = {}
+                for row in rows:
+                    by_site.setdefault(site_of(row['location']), []).append(tuple(row))
+                for site, site_rows in by_site.items():
+                    counts[site] = counts.get(site, 0) + self._import_rows(source, site, columns, site_rows)
+
+        return counts
+
+    def _import_rows(self, source, site: str, columns: list[str], rows: list[tuple]) -> int:
+        """サーバ行とその履歴をシャードへ複製し、カタログに登録"""
+        with self._catalog() as catalog:
+            ids = [row[columns.index('id')] for row in rows]
+            placeholders = ', '.join('?' * len(ids))
+            known = {row[0] for row in catalog.execute(
+                f'SELECT id FROM server_sites WHERE id IN ({placeholders})', ids
+            )}
+        rows = [row for row in rows if row[columns.index('id')] not in known]
+        if not rows:
+            return 0
+
+        ids = [row[columns.index('id')] for row in rows]
+        placeholders = ', '.join('?' * len(ids))
+        with source.connect() as conn:
+            history = conn.execute(
+                f'SELECT {_HISTORY_COLUMNS} FROM edit_history WHERE server_id IN ({placeholders}) ORDER BY id', ids
+            ).fetchall()
+
+        backend = self.backend_for_site(site)
+        with backend.connect() as conn:
+            conn.executemany(
+                f"INSERT INTO servers ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+            )
+            conn.executemany(
+                f"INSERT INTO edit_history ({_HISTORY_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [tuple(row) for row in history]
+            )
+            conn.executemany(ComponentIndex.INSERT_SQL, [
+                component
+                for row in rows
+                for component in ComponentIndex.rows(row[columns.index('id')], row[columns.index('gpu_accessories')])
+            ])
+            conn.commit()
+        with self._catalog() as catalog:
+            catalog.executemany('INSERT INTO server_sites (id, site) VALUES (?, ?)', [(i, site) for i in ids])
+            catalog.commit()
+        return len(rows)
+
+
+def main(argv: list[str] = None) -> int:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="サイト別シャードの管理")
+    parser.add_argument('command', choices=['split', 'repair', 'rebalance', 'sites'])
+    args = parser.parse_args(argv)
+
+    router = ShardRouter.get()
+    if not router.enabled:
+        print("SHARD_DIR が設定されていません。")
+        return 1
+
+    if args.command == 'split':
+        from db_core import init_database
+        init_database()
+        counts = router.split()
+        print(', '.join(f"{site}: {count:,} 台" for site, count in counts.items()) or "分割対象はありません。")
+    elif args.command == 'repair':
+        print(f"移動が中断していた {router.repair()} 台を修復しました。")
+    elif args.command == 'rebalance':
+        print(f"サイトの異なるシャードにあった {router.rebalance()} 台を移動しました。")
+    else:
+        for site in router.sites():
+            print(site)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
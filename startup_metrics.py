@@ -0,0 +1,53 @@
+"""
+起動時間計測モジュール
+
+プロセス起動後の初回描画（ログイン画面・サーバ一覧）までの時間を記録する。
+記録した値はデータ管理画面の統計情報に表示する（標準出力には出さない）。
+"""
+import os
+import threading
+from typing import Dict, Any
+
+from db_core import get_db_connection
+
+
+class StartupMetrics:
+    """起動時間の記録を管理するクラス"""
+
+    _lock = threading.Lock()
+    _recorded: set = set()
+
+    @staticmethod
+    def record_first(metric: str, seconds: float):
+        """プロセスごとに最初の1回だけ計測値を記録"""
+        with StartupMetrics._lock:
+            if metric in StartupMetrics._recorded:
+                return
+            StartupMetrics._recorded.add(metric)
+
+        with get_db_connection() as conn:
+            conn.execute(
+                'INSERT INTO startup_metrics (metric, seconds, pid) VALUES (?, ?, ?)',
+                (metric, seconds, os.getpid())
+            )
+            conn.commit()
+
+    @staticmethod
+    def get_summary(limit: int = 20) -> list[Dict[str, Any]]:
+        """計測項目ごとの直近の値と、直近 limit 件の平均"""
+        with get_db_connection() as conn:
+            rows = conn.execute('''
+                SELECT
+                    metric,
+                    (SELECT seconds FROM startup_metrics l
+                     WHERE l.metric = m.metric ORDER BY l.id DESC LIMIT 1) AS latest,
+                    (SELECT AVG(seconds) FROM (
+                        SELECT seconds FROM startup_metrics r
+                        WHERE r.metric = m.metric ORDER BY r.id DESC LIMIT ?
+                    ) recent) AS average,
+                    COUNT(*) AS samples
+                FROM startup_metrics m
+                GROUP BY metric
+                ORDER BY metric
+            ''', (limit,)).fetchall()
+            return [dict(row) for row in rows]
@@ -0,0 +1,151 @@
+"""
+ストレージバックエンドの動作確認
+
+同じ操作（登録・楽観的ロック付き更新・検索・GPU 集計・設置場所の階層・保守期限・一括更新・履歴・エクスポート・削除・一括投入）を
+指定したバックエンドに対して実行し、結果が期待どおりかを確認する。
+SQLite と PostgreSQL の両方で同じ結果になることを確認するために使う。
+
+    python storage_check.py                                        # 一時ディレクトリの SQLite
+    python storage_check.py --url postgresql://localhost/inventory_check
+
+PostgreSQL の場合はデータを書き込むため、確認専用の空のデータベースを指定すること。
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+
+
+def run(url: str = None) -> int:
+    """動作確認の実行（失敗があれば 1 を返す）"""
+    if url:
+        os.environ['DATABASE_URL'] = url
+    else:
+        os.chdir(tempfile.mkdtemp(prefix="storage_check_"))
+
+    from auth import AuthManager
+    from db_core import init_database, get_generations
+    from server_service import ServerService
+    from storage import get_backend
+
+    init_database()
+    backend = get_backend()
+    service = ServerService()
+    results = []
+
+    def check(name: str, condition: bool):
+        results.append(condition)
+        print(f"{'OK  ' if condition else 'NG  '} {name}")
+
+    def server(model, location, os_name, ip, gpu=None):
+        return {
+            'model': model, 'location': location, 'purchase_date': '2021-04-01',
+            'warranty_status': '有効', 'ip_address': ip, 'hostname': model.lower(),
+            'mac_address': None, 'user_name': None, 'os': os_name,
+            'gpu_accessories': gpu, 'notes': f"{model} check",
+        }
+
+    print(f"バックエンド: {backend.name}")
+    with AuthManager.acting_as('storage-check@example.com'):
+        with backend.connect() as conn:
+            conn.execute('''
+                INSERT INTO users (email, name, picture_url, last_login) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (email) DO UPDATE SET name = excluded.name
+            ''', ('storage-check@example.com', '確認用', ''))
+            conn.commit()
+
+        generations = get_generations()
+        first = service.create_server(server('R750', '東京DC', 'Ubuntu 22.04', '10.1.2.3', 'NVIDIA A100 80GB x2'))
+        second = service.create_server(server('DL380', '大阪DC', 'windows server', '192.168.0.10'))
+        check("登録で ID が採番される", first != second)
+        check("登録でデータ世代が進む", get_generations()['servers'] > generations.get('servers', 0))
+
+        current = service.get_server_by_id(first)
+        check("登録直後のバージョンは 1", current['version'] == 1)
+        ok, _ = service.update_server(first, current, {**current, 'os': 'Ubuntu 24.04'})
+        check("バージョン一致で更新できる", ok)
+        ok, message = service.update_server(first, current, {**current, 'os': 'Rocky'})
+        check("古いバージョンでの更新は競合になる", not ok and '確認用' in message)
+
+        check("前方一致は大文字小文字を区別しない", list(service.search_servers('os:UBUNTU*')['id']) == [first])
+        check("CIDR 指定", list(service.search_servers('ip:10.0.0.0/12')['id']) == [first])
+        check("フリーテキスト検索", list(service.search_servers('dl380')['id']) == [second])
+        check("備考も大文字小文字を区別しない",
+              list(service.search_servers('notes:r750*')['id']) == [first]
+              and list(service.search_servers('notes:"R750 CHECK"')['id']) == [first]
+              and sorted(service.search_servers('notes:*CHECK')['id']) == [first, second])
+        with backend.connect() as conn:
+            row = conn.execute("SELECT 'why?' AS question, '50%' AS percent, ? AS param", ('ok',)).fetchone()
+        check("リテラル内の ? と % はパラメータとして扱わない", tuple(row) == ('why?', '50%', 'ok'))
+        check("フリーテキストの除外（未設定の項目がある行も対象）",
+              list(service.search_servers('-dl380')['id']) == [first]
+              and list(service.search_servers('-ubuntu')['id']) == [second])
+        check("GPU 搭載数の検索", list(service.search_servers('gpus:A100>=2')['id']) == [first]
+              and list(service.search_servers('gpus<1')['id']) == [second])
+        totals = service.get_gpu_totals()
+        check("設置場所別 GPU 搭載数", totals[['location', 'model', 'gpus']].values.tolist() == [['東京DC', 'A100', 2]])
+        tree = service.get_location_tree('')
+        check("設置場所の階層", list(service.search_servers('under:東京DC')['id']) == [first]
+              and dict(zip(tree['path'], tree['count'])) == {'大阪dc/': 1, '東京dc/': 1})
+        counts = service.get_facet_counts('', {'location': ['東京DC']})
+        location_counts = dict(counts.loc[counts['facet'] == 'location', ['value', 'count']].values)
+        check("ファセット件数", location_counts == {'東京DC': 1, '大阪DC': 1})
+        third = service.create_server(server('R650', '大阪DC', 'UBUNTU 24.04', '10.1.2.4'))
+        counts = service.get_facet_counts('')
+        os_counts = counts.loc[counts['facet'] == 'os', 'count'].tolist()
+        check("ファセット件数は大文字小文字を区別しない", os_counts == [2, 1])
+        service.delete_server(third, 'storage-check@example.com', 1)
+
+        current = service.get_server_by_id(second)
+        service.bulk_update_servers([
+            (second, current['version'], {'warranty_end_date': None}, {'warranty_end_date': '2000-01-01'})
+        ])
+        expired = service.get_server_by_id(second)['warranty_status'] == '期限切れ'
+        with backend.connect() as conn:
+            conn.execute('UPDATE servers SET warranty_end_date = ? WHERE id = ?',
+                         ((date.today() + timedelta(days=10)).isoformat(), second))
+            conn.commit()
+        refreshed = service.refresh_warranty_status()
+        check("保守期限による状態の判定", expired and refreshed == 1
+              and service.get_server_by_id(second)['warranty_status'] == '有効')
+        check("保守期限が近いサーバ", list(service.get_expiring_servers(30)['id']) == [second]
+              and list(service.search_servers('expires>=0d expires<=30d')['id']) == [second])
+
+        current = service.get_server_by_id(second)
+        applied, conflicts = service.bulk_update_servers([
+            (second, current['version'], {'os': current['os']}, {'os': 'Windows Server 2022'}),
+            (first, 1, {'os': 'Ubuntu 24.04'}, {'os': 'Debian'}),
+        ])
+        check("一括更新は競合した行だけをスキップする", (applied, conflicts) == (1, 1))
+
+        history = service.history_manager.get_server_history(second)
+        check("履歴が記録される", set(history['action']) == {'CREATE', 'UPDATE'})
+        chunks = list(service.db_manager.iter_servers(1))
+        check("エクスポートはチャンク単位で取得できる", [len(chunk) for chunk in chunks] == [1, 1])
+
+        current = service.get_server_by_id(first)
+        check("古いバージョンでは削除できない",
+              not service.delete_server(first, 'storage-check@example.com', current['version'] - 1))
+        check("現在のバージョンで削除できる",
+              service.delete_server(first, 'storage-check@example.com', current['version']))
+        check("削除後は取得できない", service.get_server_by_id(first) is None)
+
+        copied = backend.copy_rows('users', ['email', 'name'], [(f"bulk{i}@example.com", f"一括{i}") for i in range(100)])
+        check("一括投入", copied == 100 and service.get_statistics()['users'] == 101)
+
+    failed = results.count(False)
+    print(f"{len(results) - failed}/{len(results)} 件成功")
+    return 1 if failed else 0
+
+
+def main(argv: list[str] = None) -> int:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="ストレージバックエンドの動作確認")
+    parser.add_argument('--url', help="確認対象の DATABASE_URL（省略時は一時ディレクトリの SQLite）")
+    args = parser.parse_args(argv)
+    return run(args.url)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,19 @@
 """
 UI共通コンポーネント
 """
+import os
+
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any
 
 from auth import AuthManager
+from card_cache import CardCache
+from login_form import LoginForm
 from server_service import ServerService
-from history_manager import HistoryManager
+from job_manager import JobManager
+from filter_query import FACET_FIELDS
 from config import WARRANTY_STATUS_OPTIONS
 
 
@@ -39,65 +44,87 @@ class UIComponents:
             return page
 
     @staticmethod
-    def render_login_form():
-        """ログインフォームの表示"""
-        st.title("🖥️ サーバ在庫管理システム")
-        st.markdown("---")
+    def get_facet_selections() -> Dict[str, list]:
+        """ファセット選択状態の取得（初回はURLのクエリパラメータから復元し、以後URLへ反映）"""
+        selections = {}
+        for facet in FACET_FIELDS:
+            key = f"facet_{facet}"
+            param = f"f_{facet}"
+            if key not in st.session_state:
+                st.session_state[key] = st.query_params.get_all(param)
+
+            selections[facet] = list(st.session_state[key])
+            if selections[facet]:
+                st.query_params[param] = selections[facet]
+            elif param in st.query_params:
+                del st.query_params[param]
+        return selections
 
-        col1, col2, col3 = st.columns([1, 2, 1])
+    @staticmethod
+    def get_location_node() -> str:
+        """選択中の設置場所ノードのパス（初回はURLのクエリパラメータ under から復元し、以後URLへ反映）"""
+        if "location_node" not in st.session_state:
+            st.session_state.location_node = st.query_params.get("under", "")
+
+        node = st.session_state.location_node
+        if node:
+            st.query_params["under"] = node
+        elif "under" in st.query_params:
+            del st.query_params["under"]
+        return node
 
-        with col2:
-            st.markdown("### Googleアカウントでログイン")
-            st.markdown("このシステムを利用するには、Googleアカウントでのログインが必要です。")
-
-            # 簡易的なGoogle認証フォーム（実際の実装では適切なOAuth2フローを使用）
-            with st.form("login_form"):
-                st.markdown("**開発用ログイン**")
-                email = st.text_input("メールアドレス", placeholder="user@example.com")
-                name = st.text_input("表示名", placeholder="山田太郎")
-
-                if st.form_submit_button("ログイン", use_container_width=True):
-                    if email and name:
-                        # 開発用の簡易ログイン
-                        user_info = {
-                            'email': email,
-                            'name': name,
-                            'picture': ''
-                        }
-                        AuthManager.login_user(user_info)
-                        st.rerun()
-                    else:
-                        st.error("メールアドレスと表示名を入力してください。")
+    @staticmethod
+    def render_location_tree(tree: pd.DataFrame):
+        """サイドバーの設置場所の階層（ノードごとの台数付き。選択したノードの配下に絞り込む）"""
+        # U 単位まで並べると項目が多くなりすぎるため、ラックまでを表示する（U は under: で指定）
+        nodes = {node.path: node for node in tree.itertuples(index=False) if node.level != 'unit'}
+        selected = st.session_state.get("location_node", "")
+        options = [''] + list(nodes) + ([selected] if selected and selected not in nodes else [])
+
+        def format_node(path: str) -> str:
+            if not path:
+                return "すべて"
+            node = nodes.get(path)
+            if node is None:
+                return f"{path} (0)"
+            return f"{'　' * node.depth}{node.name} ({node.count})"
 
-            st.markdown("---")
-            st.markdown("💡 **本番環境では**、適切なGoogle OAuth2認証を実装してください。")
+        with st.sidebar:
+            st.markdown("### 🏢 設置場所")
+            st.selectbox(
+                "階層（配下を含む）", options, key="location_node", format_func=format_node,
+                help="サイト → 建屋 → 部屋 → ラック → U の順に設置場所を区切り（/ または ／）で分けた階層"
+            )
+
+    @staticmethod
+    def render_facet_filters(facet_counts: pd.DataFrame, selections: Dict[str, list]):
+        """サイドバーのファセット絞り込み（値ごとの件数付き）"""
+        with st.sidebar:
+            st.markdown("### 🔎 絞り込み")
+            for facet, (label, _, _) in FACET_FIELDS.items():
+                rows = facet_counts[facet_counts['facet'] == facet]
+                counts = dict(zip(rows['value'], rows['count']))
+                options = list(counts) + [v for v in selections.get(facet, []) if v not in counts]
+                st.multiselect(
+                    label,
+                    options,
+                    key=f"facet_{facet}",
+                    format_func=lambda v, counts=counts: f"{v or '(未設定)'} ({counts.get(v, 0)})"
+                )
+
+    @staticmethod
+    def render_login_form():
+        """ログインフォームの表示"""
+        LoginForm.render()
 
     @staticmethod
     def render_server_card(server: pd.Series, server_service: ServerService):
-        """サーバカードの表示"""
+        """サーバカードの表示（表示内容は (ID, バージョン) ごとにキャッシュした1つのブロック）"""
         with st.container():
             col1, col2, col3 = st.columns([6, 2, 2])
 
             with col1:
-                st.markdown(f"### 🖥️ {server['model']}")
-
-                info_cols = st.columns(4)
-                with info_cols[0]:
-                    st.markdown(f"**設置場所:** {server['location'] or '-'}")
-                    st.markdown(f"**利用者:** {server['user_name'] or '-'}")
-                with info_cols[1]:
-                    st.markdown(f"**IPアドレス:** {server['ip_address'] or '-'}")
-                    st.markdown(f"**OS:** {server['os'] or '-'}")
-                with info_cols[2]:
-                    warranty_color = "🟢" if server['warranty_status'] == "有効" else "🔴"
-                    st.markdown(f"**保守契約:** {warranty_color} {server['warranty_status'] or '-'}")
-                    st.markdown(f"**GPU・付属品:** {server['gpu_accessories'] or '-'}")
-                with info_cols[3]:
-                    st.markdown(f"**購入日:** {server['purchase_date'] or '-'}")
-                    st.markdown(f"**更新者:** {server['updated_by_name'] or server['updated_by'] or '-'}")
-
-                if server['notes']:
-                    st.markdown(f"**備考:** {server['notes']}")
+                st.markdown(CardCache.get(server), unsafe_allow_html=True)
 
             with col2:
                 if st.button("✏️ 編集", key=f"edit_{server['id']}", use_container_width=True):
@@ -107,7 +134,7 @@ class UIComponents:
 
             with col3:
                 if st.button("🗑️ 削除", key=f"delete_{server['id']}", use_container_width=True):
-                    if server_service.delete_server(server['id'], st.session_state.user_email):
+                    if server_service.delete_server(int(server['id']), st.session_state.user_email, int(server['version'])):
                         st.success("サーバを削除しました。")
                         st.rerun()
                     else:
@@ -150,7 +177,13 @@ class UIComponents:
                     "保守契約状態",
                     WARRANTY_STATUS_OPTIONS,
                     index=WARRANTY_STATUS_OPTIONS.index(server_data.get('warranty_status', '有効'))
-                    if server_data.get('warranty_status') in WARRANTY_STATUS_OPTIONS else 0
+                    if server_data.get('warranty_status') in WARRANTY_STATUS_OPTIONS else 0,
+                    help="保守期限を入力した場合は保守期限から自動で判定します"
+                )
+                warranty_end_date = st.date_input(
+                    "保守期限",
+                    value=datetime.strptime(server_data['warranty_end_date'], '%Y-%m-%d').date()
+                    if server_data.get('warranty_end_date') else None
                 )
 
             with col2:
@@ -159,6 +192,15 @@ class UIComponents:
                     value=server_data.get('ip_address', ''),
                     help="例: 192.168.1.100"
                 )
+                hostname = st.text_input(
+                    "ホスト名",
+                    value=server_data.get('hostname') or ''
+                )
+                mac_address = st.text_input(
+                    "MACアドレス",
+                    value=server_data.get('mac_address') or '',
+                    help="例: 00:1a:2b:3c:4d:5e"
+                )
                 user_name = st.text_input(
                     "利用者名",
                     value=server_data.get('user_name', '')
@@ -200,7 +242,10 @@ class UIComponents:
             'location': location,
             'purchase_date': purchase_date.strftime('%Y-%m-%d') if purchase_date else '',
             'warranty_status': warranty_status,
+            'warranty_end_date': warranty_end_date.strftime('%Y-%m-%d') if warranty_end_date else '',
             'ip_address': ip_address,
+            'hostname': hostname,
+            'mac_address': mac_address,
             'user_name': user_name,
             'os': os,
             'gpu_accessories': gpu_accessories,
@@ -245,6 +290,13 @@ class UIComponents:
         with col3:
             st.metric("利用ユーザー数", stats['users'])
 
+        cache = CardCache.get_stats()
+        st.caption(
+            f"サーバカードのキャッシュ: ヒット率 {cache['hit_rate']:.1%}"
+            f"（{cache['hits']:,} / {cache['hits'] + cache['misses']:,}）、"
+            f"保持 {cache['entries']:,} / {cache['capacity']:,} 件"
+        )
+
     @staticmethod
     def create_csv_download_button(df: pd.DataFrame, filename_prefix: str, label: str):
         """CSV ダウンロードボタンの作成"""
@@ -256,3 +308,55 @@ class UIComponents:
             mime="text/csv",
             use_container_width=True
         )
+
+    @staticmethod
+    def render_job(job: pd.Series):
+        """バックグラウンドジョブの状態表示"""
+        job_labels = {
+            "export_servers": "サーバデータCSV出力",
+            "export_history": "履歴データCSV出力",
+            "backup": "バックアップ",
+            "maintenance": "定期メンテナンス",
+            "vacuum": "データベース最適化 (VACUUM)",
+            "warranty": "保守契約状態の判定",
+        }
+        status_icons = {
+            "PENDING": "⏳", "RUNNING": "🔄", "DONE": "✅",
+            "FAILED": "❌", "CANCELLED": "⛔", "INTERRUPTED": "⚠️",
+        }
+
+        with st.container():
+            col1, col2, col3 = st.columns([4, 3, 2])
+
+            with col1:
+                st.markdown(f"{status_icons.get(job['status'], '📝')} **{job_labels.get(job['kind'], job['kind'])}** (ID: {job['id']})")
+                st.caption(f"🕒 {job['created_at']}")
+
+            with col2:
+                if job['status'] in ("PENDING", "RUNNING"):
+                    st.progress(float(job['progress'] or 0), text=job['message'] or job['status'])
+                elif job['status'] == "FAILED":
+                    st.error(job['error'] or "ジョブが失敗しました。")
+                else:
+                    st.markdown(job['message'] or job['status'])
+
+            with col3:
+                if job['status'] in ("PENDING", "RUNNING"):
+                    if st.button("中止", key=f"cancel_job_{job['id']}", use_container_width=True):
+                        if JobManager.cancel(int(job['id'])):
+                            st.rerun()
+                        st.error("ジョブを中止できませんでした（すでに終了しています）。")
+                elif job['status'] == "DONE":
+                    path = job['result_path'] if isinstance(job['result_path'], str) else None
+                    if path and path.endswith('.csv') and os.path.exists(path):
+                        # ファイルはクリック時に読み込む
+                        st.download_button(
+                            label="ダウンロード",
+                            data=lambda path=path: JobManager.read_result_bytes(path),
+                            file_name=f"{job['kind'].replace('export_', '')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                            mime="text/csv",
+                            key=f"download_job_{job['id']}",
+                            use_container_width=True
+                        )
+                    elif path and isinstance(result := JobManager.get_result(int(job['id'])), dict) and 'summary' in result:
+                        st.caption(result['summary'].replace('\n', '  \n'))
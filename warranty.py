@@ -0,0 +1,124 @@
+"""
+保守契約の期限判定モジュール
+
+servers.warranty_end_date（保守期限。YYYY-MM-DD、期限日当日までを有効とする）から warranty_status を判定する。
+保守期限が設定されたサーバは期限を過ぎると「期限切れ」、それまでは「有効」とし、
+保守期限が未設定のサーバは手入力の状態をそのまま保持する。
+登録・更新時に判定するほか、定期ジョブ（job_manager.warranty_job）が日付の経過による変化を
+保守期限インデックスの範囲検索と1回の UPDATE でまとめて反映する。
+
+    python warranty.py refresh               # 保守契約状態を判定し直す
+    python warranty.py expiring --days 30    # 30日以内に保守期限を迎えるサーバ
+
+pandas に依存しない。
+"""
+import argparse
+import sys
+from datetime import date, timedelta
+from typing import Optional, Dict, Any
+
+from config import FIELD_MAPPING, WARRANTY_STATUS_OPTIONS
+
+STATUS_ACTIVE = WARRANTY_STATUS_OPTIONS[0]   # 有効
+STATUS_EXPIRED = WARRANTY_STATUS_OPTIONS[1]  # 期限切れ
+
+# 定期ジョブによる変更の変更者
+JOB_USER = 'system:warranty'
+
+# 判定結果と現在の状態が異なるサーバ（保守期限インデックスの範囲検索 2 つで求まる）
+_STALE_CONDITION = '''
+    (warranty_end_date < ? AND (warranty_status IS NULL OR warranty_status != ?))
+    OR (warranty_end_date >= ? AND (warranty_status IS NULL OR warranty_status != ?))
+'''
+
+
+class WarrantyPolicy:
+    """保守期限による保守契約状態の判定を行うクラス"""
+
+    @staticmethod
+    def today() -> str:
+        """判定の基準日（YYYY-MM-DD）"""
+        return date.today().isoformat()
+
+    @staticmethod
+    def status_for(end_date: Optional[str], current: Optional[str] = None) -> Optional[str]:
+        """保守期限から状態を判定（保守期限が未設定の場合は current をそのまま返す）"""
+        if not end_date:
+            return current
+        return STATUS_EXPIRED if str(end_date) < WarrantyPolicy.today() else STATUS_ACTIVE
+
+    @staticmethod
+    def apply(data: Dict[str, Any]) -> Dict[str, Any]:
+        """登録・更新内容の保守期限を正規化（空欄は NULL）し、設定されていれば状態を判定した内容を返す"""
+        if 'warranty_end_date' not in data:
+            return data
+        end_date = data['warranty_end_date'] or None
+        data = {**data, 'warranty_end_date': end_date}
+        if end_date:
+            data['warranty_status'] = WarrantyPolicy.status_for(end_date)
+        return data
+
+    @staticmethod
+    def expiring_range(days: int, today: str = None) -> tuple[str, str]:
+        """days 日以内に保守期限を迎える範囲 [基準日, 基準日 + days]（両端を含む）"""
+        start = date.fromisoformat(today or WarrantyPolicy.today())
+        return start.isoformat(), (start + timedelta(days=days)).isoformat()
+
+    @staticmethod
+    def refresh(conn, changed_by: Optional[str], today: str = None) -> list[tuple]:
+        """全サーバの状態を1回の UPDATE で判定し直す
+
+        呼び出し側の接続・トランザクションで実行し、コミットは呼び出し側で行う。
+        状態を変更したサーバの履歴レコード（HistoryManager.add_history_records の形式）を返す。
+        """
+        today = today or WarrantyPolicy.today()
+        params = [today, STATUS_EXPIRED, today, STATUS_ACTIVE]
+        previous = {
+            row['id']: row['warranty_status']
+            for row in conn.execute(f'SELECT id, warranty_status FROM servers WHERE {_STALE_CONDITION}', params)
+        }
+        if not previous:
+            return []
+
+        cursor = conn.execute(f'''
+            UPDATE servers SET
+                warranty_status = CASE WHEN warranty_end_date < ? THEN ? ELSE ? END,
+                version = version + 1,
+                updated_by = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE {_STALE_CONDITION}
+            RETURNING id, warranty_status
+        ''', [today, STATUS_EXPIRED, STATUS_ACTIVE, changed_by] + params)
+        label = FIELD_MAPPING['warranty_status']
+        return [
+            (row['id'], 'UPDATE', label, previous.get(row['id']) or '', row['warranty_status'])
+            for row in cursor.fetchall()
+        ]
+
+
+def main(argv: list[str] = None) -> int:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="保守契約状態の判定")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('refresh', help="保守期限から保守契約状態を判定し直す")
+    expiring_parser = subparsers.add_parser('expiring', help="保守期限が近いサーバを表示")
+    expiring_parser.add_argument('--days', type=int, default=30, help="何日以内に保守期限を迎えるか")
+    args = parser.parse_args(argv)
+
+    from db_core import init_database
+    from server_service import ServerService
+    init_database()
+    service = ServerService()
+
+    if args.command == 'refresh':
+        print(f"{service.refresh_warranty_status():,} 台の保守契約状態を更新しました。")
+        return 0
+
+    servers = service.get_expiring_servers(args.days)
+    for server in servers.itertuples(index=False):
+        print(f"{server.warranty_end_date}  {server.id:>8}  {server.model}  {server.location}")
+    print(f"{len(servers):,} 台")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())